@@ -1,34 +1,389 @@
 import os
+import time
+from datetime import date
 
-from flask import Flask, abort, jsonify, request
+from dotenv import load_dotenv
+from flask import (Flask, Response, abort, current_app, jsonify, request,
+                   stream_with_context)
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 
-from auth.auth import AuthError, requires_auth
-from database.models import Actor, Movie, db_drop_and_create_all, setup_db
+# The modules below read their settings from the environment when they are
+# imported, so the .env file (if there is one) is loaded first, here and only
+# here: importing them does no I/O
+load_dotenv()
+
+from auth.auth import AuthError, key_store, requires_auth, token_cache
+from database.counts import COUNT_MODE, COUNT_MODES, count_rows
+from database.instrumentation import init_query_stats
+from database.models import (Actor, Movie, bulk_delete, bulk_insert, bulk_update, cast,
+                             cast_columns, db, db_drop_and_create_all, narrow, select_columns,
+                             set_cast, setup_db, stream_all)
+from database.pool import pool_status
+from database.routing import replicas
+from database.search import build_search_indexes, search
+from database.seed import seed_command
+from database.stats import actor_stats, build_table_stats, movie_stats, rebuild_stats_command
+from middleware.admission import init_admission
+from middleware.compression import init_compression
+from middleware.json_provider import json_provider
+from middleware.metrics import init_metrics, metrics, timed
+from middleware.response_cache import response_cache
 
 ITEMS_PER_PAGE = 10
-
-def paginate(request, selection):
-    # Takes the page number (if not provided takes 1 as a default)
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * ITEMS_PER_PAGE
-    end = start + ITEMS_PER_PAGE
-
-    # Makes the items in in a usefull dictionary format
-    full_list = [item.format() for item in selection]
-    current_page = full_list[start:end]
-
-    return current_page, page
-
-def create_app(db_URI="", test_config=None):
+MAX_ITEMS_PER_PAGE = 100
+
+# How many rows are read from the database at once by the exports
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+# The most items accepted by one bulk request
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 5000))
+
+def limit_arg(request):
+    # Takes the page size (if not provided takes ITEMS_PER_PAGE as a default)
+    limit = request.args.get("limit", ITEMS_PER_PAGE, type=int)
+    if limit < 1 or limit > MAX_ITEMS_PER_PAGE:
+        abort(400)
+
+    return limit
+
+'''
+paginate(request, statement, id_column, order_by)
+    runs the statement, a select_columns() of the model, for the page of the request
+    returns the rows of the page, the page number and the cursor of the next page
+'''
+def paginate(request, statement, id_column, order_by=None):
+    limit = limit_arg(request)
+
+    # Keyset mode, the client sends the last id it has seen and gets the
+    # rows after it, this stays fast no matter how deep the client pages
+    after = request.args.get("after", None, type=int)
+    if after is not None:
+        # The cursor is an id so it only works with the default order
+        if order_by:
+            abort(400)
+        # Fetches one extra row to know if there is a next page
+        statement = statement.where(id_column > after) \
+            .order_by(id_column).limit(limit + 1)
+        page = None
+    else:
+        # Takes the page number (if not provided takes 1 as a default)
+        page = request.args.get("page", 1, type=int)
+        if page < 1:
+            abort(400)
+        statement = statement.order_by(*(order_by or [id_column])) \
+            .limit(limit + 1).offset((page - 1) * limit)
+
+    selection = db.session.execute(statement).all()
+    has_more = len(selection) > limit
+    selection = selection[:limit]
+
+    # Makes the rows in in a usefull dictionary format
+    with timed('serialize'):
+        current_page = [row._asdict() for row in selection]
+    # The cursor is only given when the rows are in id order
+    next_cursor = selection[-1].id if has_more and not order_by else None
+
+    return current_page, page, next_cursor
+
+'''
+sort_order(request, model, columns)
+    takes the ?sort= argument, a comma separated list of columns
+    each one can start with - to sort in descending order (i.e. sort=-age,name)
+    returns the columns to order by, the id is always last so pages are stable
+'''
+def sort_order(request, model, columns):
+    sort = request.args.get("sort")
+    if not sort:
+        return None
+
+    order_by = []
+    for name in sort.split(','):
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name not in columns:
+            abort(400)
+        column = getattr(model, name)
+        order_by.append(column.desc() if descending else column.asc())
+
+    order_by.append(model.id)
+    return order_by
+
+def date_arg(request, name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400)
+
+# Takes the actor filters of the request as SQL conditions
+def actor_filters(request):
+    filters = []
+    gender = request.args.get("gender")
+    min_age = request.args.get("min_age", None, type=int)
+    max_age = request.args.get("max_age", None, type=int)
+
+    if gender is not None:
+        filters.append(Actor.gender == gender)
+    if min_age is not None:
+        filters.append(Actor.age >= min_age)
+    if max_age is not None:
+        filters.append(Actor.age <= max_age)
+
+    return filters
+
+# Takes the movie filters of the request as SQL conditions
+def movie_filters(request):
+    filters = []
+    released_after = date_arg(request, "released_after")
+    released_before = date_arg(request, "released_before")
+
+    if released_after is not None:
+        filters.append(Movie.release_date >= released_after)
+    if released_before is not None:
+        filters.append(Movie.release_date <= released_before)
+
+    return filters
+
+def count_mode(request):
+    # Takes how the totals should be counted (if not provided takes COUNT_MODE)
+    mode = request.args.get("count", COUNT_MODE)
+    if mode not in COUNT_MODES:
+        abort(400)
+
+    return mode
+
+'''
+fields_arg(request, model)
+    takes the ?fields= argument, a comma separated list of the columns to
+    return (i.e. fields=id,name), the id is always returned
+    returns None (every column) if there is none
+'''
+def fields_arg(request, model):
+    fields = request.args.get("fields")
+    if fields is None:
+        return None
+
+    fields = {name.strip() for name in fields.split(',')}
+    if not fields <= set(model.__table__.columns.keys()):
+        abort(400)
+
+    return fields
+
+def embed_arg(request, allowed):
+    # Takes what to embed in each item of the page (i.e. ?embed=actors)
+    embed = request.args.get("embed")
+    if embed is not None and embed != allowed:
+        abort(400)
+
+    return embed is not None
+
+'''
+embed_cast(items, model, related)
+    adds the related rows of the cast to each item of the page, under the
+    related tablename (i.e. the actors of each movie), with one query for
+    the whole page like selectinload does for the ORM, so the number of
+    queries of a page doesn't grow with its size
+'''
+def embed_cast(items, model, related):
+    own, other = cast_columns(model)
+    embedded = {}
+    for item in items:
+        item[related.__tablename__] = embedded[item['id']] = []
+
+    statement = select_columns(related).add_columns(own.label('cast_item_id')) \
+        .join(cast, other == related.id) \
+        .where(own.in_(list(embedded))).order_by(own, related.id)
+    rows = db.session.execute(statement).all()
+
+    with timed('serialize'):
+        for row in rows:
+            fields = row._asdict()
+            embedded[fields.pop('cast_item_id')].append(fields)
+
+'''
+cast_page(request, model, item_id, related)
+    the page of related rows of the cast of an item (i.e. the actors of a movie)
+'''
+def cast_page(request, model, item_id, related):
+    if db.session.scalar(db.select(model.id).where(model.id == item_id)) is None:
+        abort(404)
+
+    own, other = cast_columns(model)
+    items, page, next_cursor = paginate(
+        request, select_columns(related, fields_arg(request, related)).join(cast, other == related.id).where(own == item_id),
+        related.id)
+    total = db.session.scalar(db.select(db.func.count()).select_from(cast).where(own == item_id))
+
+    return jsonify({
+        'success': True,
+        related.__tablename__: items,
+        f'total_{related.__tablename__}': total,
+        'current_page': page,
+        'next_cursor': next_cursor
+    })
+
+def is_text(value, max_length):
+    return isinstance(value, str) and 0 < len(value.strip()) <= max_length
+
+# Returns the actor columns or an error message if the item is invalid
+def validate_actor(item):
+    if not isinstance(item, dict):
+        return None, 'actor must be an object'
+    if not is_text(item.get('name'), 255):
+        return None, 'name is required'
+    age = item.get('age')
+    if not isinstance(age, int) or isinstance(age, bool) or age < 0:
+        return None, 'age must be a positive integer'
+    if not is_text(item.get('gender'), 10):
+        return None, 'gender is required'
+
+    return {'name': item['name'], 'age': age, 'gender': item['gender']}, None
+
+# Returns the movie columns or an error message if the item is invalid
+def validate_movie(item):
+    if not isinstance(item, dict):
+        return None, 'movie must be an object'
+    if not is_text(item.get('title'), 255):
+        return None, 'title is required'
+    try:
+        release_date = date.fromisoformat(item.get('release_date'))
+    except (TypeError, ValueError):
+        return None, 'release_date must be a date (YYYY-MM-DD)'
+
+    return {'title': item['title'], 'release_date': release_date}, None
+
+def item_id(item):
+    row_id = item.get('id')
+    if not isinstance(row_id, int) or isinstance(row_id, bool) or row_id < 1:
+        return None
+    return row_id
+
+'''
+validate_actor_changes(item) / validate_movie_changes(item)
+    for the bulk PATCH requests, an item is the id and the fields to change
+    (i.e. {"id": 1, "age": 40}), like the body of a single PATCH
+    returns (id, columns) or an error message if the item is invalid
+'''
+def validate_actor_changes(item):
+    if not isinstance(item, dict) or item_id(item) is None:
+        return None, 'id must be a positive integer'
+
+    fields = {}
+    if item.get('name') is not None:
+        if not is_text(item['name'], 255):
+            return None, 'name must be a text'
+        fields['name'] = item['name']
+    if item.get('age') is not None:
+        age = item['age']
+        if not isinstance(age, int) or isinstance(age, bool) or age < 0:
+            return None, 'age must be a positive integer'
+        fields['age'] = age
+    if item.get('gender') is not None:
+        if not is_text(item['gender'], 10):
+            return None, 'gender must be a text'
+        fields['gender'] = item['gender']
+
+    if not fields:
+        return None, 'nothing to update'
+    return (item['id'], fields), None
+
+def validate_movie_changes(item):
+    if not isinstance(item, dict) or item_id(item) is None:
+        return None, 'id must be a positive integer'
+
+    fields = {}
+    if item.get('title') is not None:
+        if not is_text(item['title'], 255):
+            return None, 'title must be a text'
+        fields['title'] = item['title']
+    if item.get('release_date') is not None:
+        try:
+            fields['release_date'] = date.fromisoformat(item['release_date'])
+        except (TypeError, ValueError):
+            return None, 'release_date must be a date (YYYY-MM-DD)'
+
+    if not fields:
+        return None, 'nothing to update'
+    return (item['id'], fields), None
+
+def merge_changes(changes):
+    # The same id can be sent more than once, its fields are merged
+    merged = {}
+    for row_id, fields in changes:
+        merged.setdefault(row_id, {}).update(fields)
+    return merged
+
+def not_found_errors(ids, found):
+    found = set(found)
+    return [{'id': row_id, 'message': 'resource not found'} for row_id in ids if row_id not in found]
+
+def ids_arg(request):
+    # Takes the ids of a bulk DELETE (i.e. ?ids=1,2,3)
+    try:
+        ids = {int(value) for value in request.args.get("ids", "").split(',') if value.strip()}
+    except ValueError:
+        abort(400)
+
+    if len(ids) == 0:
+        abort(400)
+    if len(ids) > BULK_MAX_ITEMS:
+        abort(413)
+
+    return sorted(ids)
+
+'''
+validate_items(request, key, validate)
+    takes the list of items of a bulk request, either the body itself
+    or the list under key (i.e. {"actors": [...]})
+    returns the valid rows and the errors of the invalid ones
+'''
+def validate_items(request, key, validate):
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get(key)
+
+    if not isinstance(body, list) or len(body) == 0:
+        abort(400)
+    if len(body) > BULK_MAX_ITEMS:
+        abort(413)
+
+    rows, errors = [], []
+    for index, item in enumerate(body):
+        row, error = validate(item)
+        if error:
+            errors.append({'index': index, 'message': error})
+        else:
+            rows.append(row)
+
+    return rows, errors
+
+'''
+export(model)
+    streams every row of the table as newline delimited JSON (one row per line)
+    the response starts before the whole table is read
+'''
+def export(model):
+    fields = fields_arg(request, model)
+
+    def generate():
+        for rows in stream_all(model, EXPORT_BATCH_SIZE, fields):
+            yield ''.join(current_app.json.dumps(row) + '\n' for row in rows)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def create_app(db_URI="", test_config=None, replica_URIs=None):
     # create and configure the app
     app = Flask(__name__)
+    # orjson when it is installed, see middleware/json_provider.py
+    app.json = json_provider(app)
 
     if db_URI:
-        setup_db(app, db_URI)
+        setup_db(app, db_URI, replica_URIs)
     else:
-        setup_db(app)  
+        setup_db(app, replica_urls=replica_URIs)
 
     """
     Uncomment these to reset the database
@@ -37,28 +392,71 @@ def create_app(db_URI="", test_config=None):
     # with app.app_context():
     #   db_drop_and_create_all()
 
+    # Nothing here connects to the database or Auth0, the pool, the search
+    # indexes and the signing keys are loaded by the first requests that
+    # need them or ahead of them by warmup()
+
     CORS(app)
+    init_metrics(app)
+    # After the metrics, so the time spent waiting for a turn is measured
+    init_admission(app)
+    init_query_stats(app)
+    # Last, so it runs before the other after_request functions and its
+    # time is part of the request time
+    init_compression(app)
+
+    # Exposes the token cache with the request metrics
+    for stat in ('hits', 'misses', 'size'):
+        metrics.gauge(
+            f'auth_token_cache_{stat}', f'Token cache {stat} of this worker.',
+            lambda stat=stat: token_cache.stats()[stat])
 
     @app.route('/health')
     def health():
         return "Up and Running!"
 
+    @app.route('/health/pool')
+    def health_pool():
+        # Connections of this worker and how long requests waited for them
+        return jsonify({
+            'success': True,
+            'pool': pool_status(db.engine),
+            'replicas': {key: dict(status, **pool_status(db.engines[key]))
+                         for key, status in replicas.status(db.engines).items()}
+        })
+
+    @app.route('/metrics')
+    def get_metrics():
+        # Per route latency (split by phase) and status counters of this worker
+        return Response(metrics.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
     @app.route('/actors', methods=['GET'])
     @requires_auth('get:actors')
+    @response_cache.cached('actors', embedded=('movies', 'cast'))
     def get_actors(jwt):
-        actors = Actor.query.order_by(Actor.id).all()
-        current_actors, current_page = paginate(request, actors)
+        mode = count_mode(request)
+        filters = actor_filters(request)
+        order_by = sort_order(request, Actor, ['id', 'name', 'age', 'gender'])
+        embed = embed_arg(request, 'movies')
+        current_actors, current_page, next_cursor = paginate(
+            request, select_columns(Actor, fields_arg(request, Actor)).where(*filters),
+            Actor.id, order_by)
 
         # If there is no actors raises 404 error
         if len(current_actors) == 0:
             abort(404)
 
+        if embed:
+            embed_cast(current_actors, Actor, Movie)
+
         try:
             return jsonify({
                 'success': True,
                 'actors': current_actors,
-                'total_actors': len(actors),
-                'current_page': current_page
+                'total_actors': count_rows(Actor, mode, filters),
+                'current_page': current_page,
+                'next_cursor': next_cursor
             })
         except:
             # If anything happened it is propably an internal error
@@ -67,29 +465,156 @@ def create_app(db_URI="", test_config=None):
 
     @app.route('/movies', methods=['GET'])
     @requires_auth('get:movies')
+    @response_cache.cached('movies', embedded=('actors', 'cast'))
     def get_movies(jwt):
-        movies = Movie.query.order_by(Movie.id).all()
-        current_movies, current_page = paginate(request, movies)
+        mode = count_mode(request)
+        filters = movie_filters(request)
+        order_by = sort_order(request, Movie, ['id', 'title', 'release_date'])
+        embed = embed_arg(request, 'actors')
+        current_movies, current_page, next_cursor = paginate(
+            request, select_columns(Movie, fields_arg(request, Movie)).where(*filters),
+            Movie.id, order_by)
 
         # If there is no movies raises 404 error
         if len(current_movies) == 0:
             abort(404)
 
+        if embed:
+            embed_cast(current_movies, Movie, Actor)
+
         try:
            return jsonify({
                 'success': True,
                 'movies': current_movies,
-                'total_movies': len(movies),
-                'current_page': current_page
+                'total_movies': count_rows(Movie, mode, filters),
+                'current_page': current_page,
+                'next_cursor': next_cursor
             })
         except:
             # If anything happened it is propably an internal error
             abort(500)
 
 
+    @app.route('/movies/<int:movie_id>/actors', methods=['GET'])
+    @requires_auth('get:actors')
+    @response_cache.cached('movies', 'actors', 'cast')
+    def get_movie_actors(jwt, movie_id):
+        return cast_page(request, Movie, movie_id, Actor)
+
+
+    @app.route('/actors/<int:actor_id>/movies', methods=['GET'])
+    @requires_auth('get:movies')
+    @response_cache.cached('actors', 'movies', 'cast')
+    def get_actor_movies(jwt, actor_id):
+        return cast_page(request, Actor, actor_id, Movie)
+
+
+    @app.route('/movies/<int:movie_id>/actors', methods=['PUT'])
+    @requires_auth('patch:movie')
+    def edit_movie_actors(jwt, movie_id):
+        body = request.get_json(silent=True)
+        actor_ids = body.get('actors') if isinstance(body, dict) else None
+
+        # Takes the ids of the whole cast, an empty list removes it
+        if not isinstance(actor_ids, list) or \
+                not all(isinstance(actor_id, int) and not isinstance(actor_id, bool)
+                        for actor_id in actor_ids):
+            abort(400)
+        if len(actor_ids) > BULK_MAX_ITEMS:
+            abort(413)
+
+        if db.session.scalar(db.select(Movie.id).where(Movie.id == movie_id)) is None:
+            abort(404)
+        found = set(db.session.scalars(db.select(Actor.id).where(Actor.id.in_(actor_ids))))
+        # Every actor must exist
+        if len(found) != len(set(actor_ids)):
+            abort(422)
+
+        try:
+            set_cast(movie_id, found)
+        except:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'movie_id': movie_id,
+            'actors': sorted(found)
+        })
+
+
+    @app.route('/actors/export', methods=['GET'])
+    @requires_auth('get:actors')
+    def export_actors(jwt):
+        return export(Actor)
+
+
+    @app.route('/movies/export', methods=['GET'])
+    @requires_auth('get:movies')
+    def export_movies(jwt):
+        return export(Movie)
+
+
+    @app.route('/actors/stats', methods=['GET'])
+    @requires_auth('get:actors')
+    def get_actor_stats(jwt):
+        # Kept in memory and updated on every change, no table scan
+        return jsonify(dict(actor_stats(), success=True))
+
+
+    @app.route('/movies/stats', methods=['GET'])
+    @requires_auth('get:movies')
+    def get_movie_stats(jwt):
+        return jsonify(dict(movie_stats(), success=True))
+
+
+    @app.route('/actors/search', methods=['GET'])
+    @requires_auth('get:actors')
+    def search_actors(jwt):
+        query = request.args.get('q', '').strip()
+        limit = limit_arg(request)
+
+        # A search term is required
+        if not query:
+            abort(400)
+
+        actors = search(Actor, query, limit, fields_arg(request, Actor))
+
+        with timed('serialize'):
+            results = [actor._asdict() for actor in actors]
+
+        return jsonify({
+            'success': True,
+            'actors': results,
+            'total_results': len(actors)
+        })
+
+
+    @app.route('/movies/search', methods=['GET'])
+    @requires_auth('get:movies')
+    def search_movies(jwt):
+        query = request.args.get('q', '').strip()
+        limit = limit_arg(request)
+
+        # A search term is required
+        if not query:
+            abort(400)
+
+        movies = search(Movie, query, limit, fields_arg(request, Movie))
+
+        with timed('serialize'):
+            results = [movie._asdict() for movie in movies]
+
+        return jsonify({
+            'success': True,
+            'movies': results,
+            'total_results': len(movies)
+        })
+
+
     @app.route('/actors/<actor_id>', methods=['DELETE'])
     @requires_auth('delete:actor')
     def delete_actor(jwt, actor_id):
+        mode = count_mode(request)
         actor = Actor.query.get(actor_id)
 
         # If the actor doesn't exist it raises an error
@@ -99,12 +624,10 @@ def create_app(db_URI="", test_config=None):
         try:
             actor.delete()
 
-            actors = Actor.query.all()
-
             return jsonify({
                 'success': True,
                 'deleted': actor_id,
-                'total_actors': len(actors)
+                'total_actors': count_rows(Actor, mode)
             })
         except:
             # If any error occurs
@@ -114,6 +637,7 @@ def create_app(db_URI="", test_config=None):
     @app.route('/movies/<movie_id>', methods=['DELETE'])
     @requires_auth('delete:movie')
     def delete_movie(jwt, movie_id):
+        mode = count_mode(request)
         movie = Movie.query.get(movie_id)
 
         # If the movie doesn't exist it raises an error
@@ -123,12 +647,50 @@ def create_app(db_URI="", test_config=None):
         try:
             movie.delete()
 
-            movies = Movie.query.all()
-
             return jsonify({
                 'success': True,
                 'deleted': movie_id,
-                'total_movies': len(movies)
+                'total_movies': count_rows(Movie, mode)
+            })
+        except:
+            # If any error occurs
+            abort(422)
+
+
+    @app.route('/actors', methods=['DELETE'])
+    @requires_auth('delete:actor')
+    def delete_actors(jwt):
+        mode = count_mode(request)
+        ids = ids_arg(request)
+
+        try:
+            deleted = bulk_delete(Actor, ids)
+
+            return jsonify({
+                'success': True,
+                'deleted': deleted,
+                'errors': not_found_errors(ids, deleted),
+                'total_actors': count_rows(Actor, mode)
+            })
+        except:
+            # If any error occurs
+            abort(422)
+
+
+    @app.route('/movies', methods=['DELETE'])
+    @requires_auth('delete:movie')
+    def delete_movies(jwt):
+        mode = count_mode(request)
+        ids = ids_arg(request)
+
+        try:
+            deleted = bulk_delete(Movie, ids)
+
+            return jsonify({
+                'success': True,
+                'deleted': deleted,
+                'errors': not_found_errors(ids, deleted),
+                'total_movies': count_rows(Movie, mode)
             })
         except:
             # If any error occurs
@@ -138,6 +700,8 @@ def create_app(db_URI="", test_config=None):
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actor')
     def add_actor(jwt):
+        mode = count_mode(request)
+
         # gets the nessecary items from the request
         body = request.get_json()
         name = body.get('name')
@@ -155,7 +719,7 @@ def create_app(db_URI="", test_config=None):
             return jsonify({
                 'success': True,
                 'added': new_actor.id,
-                'total_actors': len(Actor.query.all())
+                'total_actors': count_rows(Actor, mode)
             })
         except:
             abort(422)
@@ -164,6 +728,8 @@ def create_app(db_URI="", test_config=None):
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movie')
     def add_movie(jwt):
+        mode = count_mode(request)
+
         # gets the nessecary items from the request
         body = request.get_json()
         title = body.get('title')
@@ -180,7 +746,47 @@ def create_app(db_URI="", test_config=None):
             return jsonify({
                 'success': True,
                 'added': new_movie.id,
-                'total_movies': len(Movie.query.all())
+                'total_movies': count_rows(Movie, mode)
+            })
+        except:
+            abort(422)
+
+
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('post:actor')
+    def add_actors(jwt):
+        mode = count_mode(request)
+        # validates every item before inserting any of them
+        rows, errors = validate_items(request, 'actors', validate_actor)
+
+        try:
+            added = bulk_insert(Actor, rows) if rows else []
+
+            return jsonify({
+                'success': True,
+                'added': added,
+                'errors': errors,
+                'total_actors': count_rows(Actor, mode)
+            })
+        except:
+            abort(422)
+
+
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('post:movie')
+    def add_movies(jwt):
+        mode = count_mode(request)
+        # validates every item before inserting any of them
+        rows, errors = validate_items(request, 'movies', validate_movie)
+
+        try:
+            added = bulk_insert(Movie, rows) if rows else []
+
+            return jsonify({
+                'success': True,
+                'added': added,
+                'errors': errors,
+                'total_movies': count_rows(Movie, mode)
             })
         except:
             abort(422)
@@ -189,6 +795,7 @@ def create_app(db_URI="", test_config=None):
     @app.route('/actors/<actor_id>', methods=['PATCH'])
     @requires_auth('patch:actor')
     def edit_actor(jwt, actor_id):
+        fields = fields_arg(request, Actor)
         actor = Actor.query.get(actor_id)
 
         # If the actor doesn't exist it raises an error
@@ -214,7 +821,7 @@ def create_app(db_URI="", test_config=None):
 
             return jsonify({
                 'success': True,
-                'updated': actor.format()
+                'updated': actor.format(fields)
             })
         except:
             abort(500)
@@ -223,6 +830,7 @@ def create_app(db_URI="", test_config=None):
     @app.route('/movies/<movie_id>', methods=['PATCH'])
     @requires_auth('patch:movie')
     def edit_movie(jwt, movie_id):
+        fields = fields_arg(request, Movie)
         movie = Movie.query.get(movie_id)
 
         # If the movie doesn't exist it raises an error
@@ -245,12 +853,54 @@ def create_app(db_URI="", test_config=None):
 
             return jsonify({
                 'success': True,
-                'updated': movie.format()
+                'updated': movie.format(fields)
             })
         except:
             abort(500)
 
 
+    @app.route('/actors', methods=['PATCH'])
+    @requires_auth('patch:actor')
+    def edit_actors(jwt):
+        fields = fields_arg(request, Actor)
+        # validates every item before updating any of them
+        changes, errors = validate_items(request, 'actors', validate_actor_changes)
+        changes = merge_changes(changes)
+
+        try:
+            updated = bulk_update(Actor, changes) if changes else []
+        except:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            # Every column is read back for the change listeners, only the output is narrowed
+            'updated': [narrow(row, fields) for row in updated],
+            'errors': errors + not_found_errors(changes, [row['id'] for row in updated])
+        })
+
+
+    @app.route('/movies', methods=['PATCH'])
+    @requires_auth('patch:movie')
+    def edit_movies(jwt):
+        fields = fields_arg(request, Movie)
+        # validates every item before updating any of them
+        changes, errors = validate_items(request, 'movies', validate_movie_changes)
+        changes = merge_changes(changes)
+
+        try:
+            updated = bulk_update(Movie, changes) if changes else []
+        except:
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            # Every column is read back for the change listeners, only the output is narrowed
+            'updated': [narrow(row, fields) for row in updated],
+            'errors': errors + not_found_errors(changes, [row['id'] for row in updated])
+        })
+
+
 
     """Error handlers for expected errors"""
     @app.errorhandler(400)
@@ -280,6 +930,15 @@ def create_app(db_URI="", test_config=None):
                 "message": "method not allowed"
             }), 405)
 
+    @app.errorhandler(413)
+    def too_large(error):
+        return (
+            jsonify({
+                "success": False,
+                "error": 413,
+                "message": "payload too large"
+            }), 413)
+
     @app.errorhandler(422)
     def unprocessable(error):
         return (
@@ -307,14 +966,67 @@ def create_app(db_URI="", test_config=None):
         }), error.status_code
 
 
+    # flask seed, fake actors and movies for load tests
+    app.cli.add_command(seed_command)
+    # flask rebuild-stats, the statistics of /actors/stats and /movies/stats
+    app.cli.add_command(rebuild_stats_command)
+
+    @app.cli.command('warmup')
+    def warmup_command():
+        """Connects to the database and Auth0 and prints how long it took."""
+        for step, seconds in warmup(app).items():
+            print(f'{step:<16} {seconds * 1000:8.1f} ms')
+
     return app
 
-app = create_app()
+'''
+warmup(app)
+    does the work otherwise left to the first requests: opens a database
+    connection, loads the search indexes and the statistics and fetches
+    the signing keys
+    called by the workers of gunicorn.conf.py when WARMUP=true, a failed
+    step is printed and left to the requests
+    returns the seconds taken by each step
+'''
+def warmup(app):
+    steps = (
+        ('database', lambda: db.session.execute(db.select(1))),
+        ('search_indexes', build_search_indexes),
+        ('table_stats', build_table_stats),
+        ('signing_keys', key_store.refresh)
+    )
+
+    timings = {}
+    with app.app_context():
+        for step, function in steps:
+            start = time.perf_counter()
+            try:
+                function()
+            except Exception as e:
+                print(f'ERROR ==> Warmup of the {step} failed: {e}')
+            timings[step] = time.perf_counter() - start
+        db.session.remove()
+
+    return timings
+
+'''
+app
+    the application of flask run and gunicorn app:app, it is created the
+    first time it is looked up instead of on import, so importing this module
+    (i.e. for create_app) does no work
+'''
+def __getattr__(name):
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 # if __name__ == '__main__':
 #     app.run(host='0.0.0.0', port=8080, debug=True)
 
 # To handle each Auth
 if __name__ == "__main__":
+    app = create_app()
     app.debug = True
     app.run()
\ No newline at end of file
@@ -0,0 +1,390 @@
+from contextlib import asynccontextmanager
+from datetime import date
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+# Like in app.py the settings are read on import, so .env is loaded first
+load_dotenv()
+
+from auth.auth import AuthError, requires_auth_async
+from database.models import Actor, Movie, database_path, select_columns
+from database.pool import (DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE,
+                           DB_POOL_SIZE, DB_POOL_TIMEOUT)
+from middleware.json_provider import dumps
+
+'''
+ASGI version of the actors and movies endpoints of app.py
+the handlers are async and use an async engine (asyncpg/aiosqlite)
+so a worker doesn't hold a thread while waiting on the database or Auth0
+
+To run it:
+    uvicorn asgi:app --workers 4
+'''
+
+ITEMS_PER_PAGE = 10
+MAX_ITEMS_PER_PAGE = 100
+
+
+'''
+async_database_url(database_path)
+    the same database with its async driver
+'''
+def async_database_url(database_path):
+    for prefix, async_prefix in (('postgresql://', 'postgresql+asyncpg://'),
+                                 ('postgres://', 'postgresql+asyncpg://'),
+                                 ('sqlite://', 'sqlite+aiosqlite://')):
+        if database_path.startswith(prefix):
+            return async_prefix + database_path[len(prefix):]
+    return database_path
+
+
+def async_engine_options(database_path):
+    if database_path.startswith('sqlite'):
+        return {}
+
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+
+# Renders the JSON like Flask's jsonify (dates as HTTP dates, sorted keys)
+class FlaskJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def int_arg(request, name, default=None):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def date_value(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(400)
+
+
+async def json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400)
+    if not isinstance(body, dict):
+        raise HTTPException(400)
+    return body
+
+
+'''
+paginate(request, session, model)
+    same paging as app.py, ?page=<page_number> or ?after=<last_seen_id>
+    and &limit=<page_size>, done with LIMIT/OFFSET or a keyset in SQL
+'''
+async def paginate(request, session, model):
+    limit = int_arg(request, 'limit', ITEMS_PER_PAGE)
+    if limit < 1 or limit > MAX_ITEMS_PER_PAGE:
+        raise HTTPException(400)
+
+    after = int_arg(request, 'after')
+    statement = select_columns(model).order_by(model.id).limit(limit + 1)
+    if after is not None:
+        statement = statement.where(model.id > after)
+        page = None
+    else:
+        page = int_arg(request, 'page', 1)
+        if page < 1:
+            raise HTTPException(400)
+        statement = statement.offset((page - 1) * limit)
+
+    selection = (await session.execute(statement)).all()
+    has_more = len(selection) > limit
+    selection = selection[:limit]
+
+    current_page = [row._asdict() for row in selection]
+    next_cursor = selection[-1].id if has_more else None
+
+    return current_page, page, next_cursor
+
+
+async def count(session, model):
+    return await session.scalar(select(func.count()).select_from(model))
+
+
+async def get_or_404(session, model, item_id):
+    try:
+        item = await session.get(model, int(item_id))
+    except ValueError:
+        item = None
+
+    # If the item doesn't exist it raises an error
+    if item is None:
+        raise HTTPException(404)
+
+    return item
+
+
+def create_asgi_app(db_URI=""):
+    db_URI = db_URI or database_path
+    engine = create_async_engine(async_database_url(db_URI), **async_engine_options(db_URI))
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def health(request):
+        return PlainTextResponse("Up and Running!")
+
+    @requires_auth_async('get:actors')
+    async def get_actors(jwt, request):
+        async with Session() as session:
+            current_actors, current_page, next_cursor = await paginate(request, session, Actor)
+
+            # If there is no actors raises 404 error
+            if len(current_actors) == 0:
+                raise HTTPException(404)
+
+            return FlaskJSONResponse({
+                'success': True,
+                'actors': current_actors,
+                'total_actors': await count(session, Actor),
+                'current_page': current_page,
+                'next_cursor': next_cursor
+            })
+
+    @requires_auth_async('get:movies')
+    async def get_movies(jwt, request):
+        async with Session() as session:
+            current_movies, current_page, next_cursor = await paginate(request, session, Movie)
+
+            # If there is no movies raises 404 error
+            if len(current_movies) == 0:
+                raise HTTPException(404)
+
+            return FlaskJSONResponse({
+                'success': True,
+                'movies': current_movies,
+                'total_movies': await count(session, Movie),
+                'current_page': current_page,
+                'next_cursor': next_cursor
+            })
+
+    @requires_auth_async('delete:actor')
+    async def delete_actor(jwt, request):
+        actor_id = request.path_params['actor_id']
+        async with Session() as session:
+            actor = await get_or_404(session, Actor, actor_id)
+
+            try:
+                await session.delete(actor)
+                await session.commit()
+
+                return FlaskJSONResponse({
+                    'success': True,
+                    'deleted': actor_id,
+                    'total_actors': await count(session, Actor)
+                })
+            except Exception:
+                # If any error occurs
+                raise HTTPException(422)
+
+    @requires_auth_async('delete:movie')
+    async def delete_movie(jwt, request):
+        movie_id = request.path_params['movie_id']
+        async with Session() as session:
+            movie = await get_or_404(session, Movie, movie_id)
+
+            try:
+                await session.delete(movie)
+                await session.commit()
+
+                return FlaskJSONResponse({
+                    'success': True,
+                    'deleted': movie_id,
+                    'total_movies': await count(session, Movie)
+                })
+            except Exception:
+                # If any error occurs
+                raise HTTPException(422)
+
+    @requires_auth_async('post:actor')
+    async def add_actor(jwt, request):
+        # gets the nessecary items from the request
+        body = await json_body(request)
+        name = body.get('name')
+        age = body.get('age')
+        gender = body.get('gender')
+
+        # To make sure all the fields are provided in the request
+        if name is None or age is None or gender is None:
+            raise HTTPException(400)
+
+        async with Session() as session:
+            try:
+                new_actor = Actor(name=name, age=age, gender=gender)
+                session.add(new_actor)
+                await session.commit()
+
+                return FlaskJSONResponse({
+                    'success': True,
+                    'added': new_actor.id,
+                    'total_actors': await count(session, Actor)
+                })
+            except Exception:
+                raise HTTPException(422)
+
+    @requires_auth_async('post:movie')
+    async def add_movie(jwt, request):
+        # gets the nessecary items from the request
+        body = await json_body(request)
+        title = body.get('title')
+        release_date = body.get('release_date')
+
+        # To make sure all the fields are provided in the request
+        if title is None or release_date is None:
+            raise HTTPException(400)
+
+        release_date = date_value(release_date)
+
+        async with Session() as session:
+            try:
+                new_movie = Movie(title=title, release_date=release_date)
+                session.add(new_movie)
+                await session.commit()
+
+                return FlaskJSONResponse({
+                    'success': True,
+                    'added': new_movie.id,
+                    'total_movies': await count(session, Movie)
+                })
+            except Exception:
+                raise HTTPException(422)
+
+    @requires_auth_async('patch:actor')
+    async def edit_actor(jwt, request):
+        async with Session() as session:
+            actor = await get_or_404(session, Actor, request.path_params['actor_id'])
+
+            # gets the nessecary items from the request
+            body = await json_body(request)
+
+            try:
+                # To make sure only the provided fields are updated
+                for field in ('name', 'age', 'gender'):
+                    if body.get(field) is not None:
+                        setattr(actor, field, body[field])
+
+                await session.commit()
+
+                return FlaskJSONResponse({
+                    'success': True,
+                    'updated': actor.format()
+                })
+            except Exception:
+                raise HTTPException(500)
+
+    @requires_auth_async('patch:movie')
+    async def edit_movie(jwt, request):
+        async with Session() as session:
+            movie = await get_or_404(session, Movie, request.path_params['movie_id'])
+
+            # gets the nessecary items from the request
+            body = await json_body(request)
+            title = body.get('title')
+            release_date = body.get('release_date')
+
+            if release_date is not None:
+                release_date = date_value(release_date)
+
+            try:
+                # To make sure only the provided fields are updated
+                if title is not None:
+                    movie.title = title
+                if release_date is not None:
+                    movie.release_date = release_date
+
+                await session.commit()
+
+                return FlaskJSONResponse({
+                    'success': True,
+                    'updated': movie.format()
+                })
+            except Exception:
+                raise HTTPException(500)
+
+    """Error handlers for expected errors"""
+    messages = {
+        400: "bad request",
+        404: "resource not found",
+        405: "method not allowed",
+        422: "unprocessable",
+        500: "internal server error"
+    }
+
+    async def http_error(request, error):
+        return FlaskJSONResponse({
+            "success": False,
+            "error": error.status_code,
+            "message": messages.get(error.status_code, error.detail)
+        }, status_code=error.status_code)
+
+    async def handle_auth_error(request, error):
+        return FlaskJSONResponse({
+            'success': False,
+            'error': error.error,
+            'status_code': error.status_code
+        }, status_code=error.status_code)
+
+    async def internal_error(request, error):
+        return await http_error(request, HTTPException(500))
+
+    routes = [
+        Route('/health', health),
+        Route('/actors', get_actors, methods=['GET']),
+        Route('/actors', add_actor, methods=['POST']),
+        Route('/actors/{actor_id}', delete_actor, methods=['DELETE']),
+        Route('/actors/{actor_id}', edit_actor, methods=['PATCH']),
+        Route('/movies', get_movies, methods=['GET']),
+        Route('/movies', add_movie, methods=['POST']),
+        Route('/movies/{movie_id}', delete_movie, methods=['DELETE']),
+        Route('/movies/{movie_id}', edit_movie, methods=['PATCH'])
+    ]
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    app = Starlette(
+        routes=routes,
+        middleware=[Middleware(CORSMiddleware, allow_origins=['*'],
+                               allow_methods=['*'], allow_headers=['*'])],
+        exception_handlers={
+            HTTPException: http_error,
+            AuthError: handle_auth_error,
+            Exception: internal_error
+        },
+        lifespan=lifespan
+    )
+    app.state.engine = engine
+
+    return app
+
+
+# Created the first time it is looked up (by uvicorn asgi:app), not on import
+def __getattr__(name):
+    if name == 'app':
+        global app
+        app = create_asgi_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,18 +1,57 @@
-import json
 import os
+import time
 from functools import wraps
-from urllib.request import urlopen
 
-from dotenv import load_dotenv
 from flask import _request_ctx_stack, abort, request
 from jose import jwt
 
-load_dotenv()
+from auth.jwks import JWKSKeyStore, verify_signature
+from auth.token_cache import TokenCache
+from middleware.metrics import record_phase, timed
+
+'''
+parse_algorithms(value)
+    the algorithms of a comma separated list (i.e. "RS256,RS384") or of a
+    list like the one of setup.sh (['RS256']) as a tuple, so the alg of a
+    token is compared with whole names
+    returns None if there is none
+'''
+def parse_algorithms(value):
+    names = (value or '').strip().strip('[]').split(',')
+    algorithms = tuple(name.strip().strip('\'"') for name in names if name.strip().strip('\'"'))
+    return algorithms or None
+
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
-ALGORITHMS = os.environ.get('ALGORITHMS')
+ALGORITHMS = parse_algorithms(os.environ.get('ALGORITHMS'))
 API_AUDIENCE = os.environ.get('API_AUDIENCE')
 
+# Where the public keys come from, JWKS_FILE is meant for local runs and tests
+JWKS_URL = os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_FILE = os.environ.get('JWKS_FILE')
+
+# How long (in seconds) the keys are trusted before being refreshed
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 600))
+JWKS_STALE_TTL = int(os.environ.get('JWKS_STALE_TTL', 86400))
+JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+
+key_store_options = {
+    'ttl': JWKS_TTL,
+    'stale_ttl': JWKS_STALE_TTL,
+    'min_refresh_interval': JWKS_MIN_REFRESH_INTERVAL
+}
+# Nothing is fetched here, the keys are fetched by the first token to
+# verify or by the warmup of app.py
+if JWKS_FILE:
+    key_store = JWKSKeyStore.from_file(JWKS_FILE, **key_store_options)
+else:
+    key_store = JWKSKeyStore.from_url(JWKS_URL, **key_store_options)
+
+# How many verified tokens are kept in memory (0 turns the cache off)
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
 
 # AuthError Exception
 '''
@@ -27,7 +66,10 @@ class AuthError(Exception):
 
 # Auth Header
 def get_token_auth_header():
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
+
+def parse_auth_header(auth):
     # if there is no header
     if not auth:
         print('ERROR ==> Authorization header is expected')
@@ -60,18 +102,22 @@ def get_token_auth_header():
     @INPUTS
         permission: string permission (i.e. 'post:drink')
         payload: decoded jwt payload
+        permissions: (optional) the payload permissions as a set
 
     it should raise an AuthError if permissions are not included in the payload
         !!NOTE check your RBAC settings in Auth0
     it should raise an AuthError if the requested permission string is not in the payload permissions array
     return true otherwise
 '''
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, permissions=None):
     if 'permissions' not in payload:
         print('ERROR ==> Permissions not included in JWT')
         raise AuthError('Permissions not included in JWT.', 400)
 
-    if permission not in payload['permissions']:
+    if permissions is None:
+        permissions = payload['permissions']
+
+    if permission not in permissions:
         print('ERROR ==> Permission not found')
         raise AuthError('Permission not found.', 403)
 
@@ -84,14 +130,32 @@ def check_permissions(permission, payload):
 
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        (through key_store which keeps the keys in memory)
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
 '''
 def verify_decode_jwt(token):
-    # this is to compare with the provided token to make sure it is valid
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    unverified_header = get_unverified_header(token)
+
+    # looks up the public key with the same key id, the keys are cached
+    # so this doesn't fetch the jwks.json on every request
+    with timed('auth_key_lookup'):
+        rsa_key = key_store.get_key(unverified_header['kid'])
+
+    with timed('auth_decode'):
+        return decode_jwt(token, unverified_header, rsa_key)
+
+
+# Same as verify_decode_jwt but doesn't block the event loop to fetch the keys
+async def verify_decode_jwt_async(token):
+    unverified_header = get_unverified_header(token)
+    rsa_key = await key_store.get_key_async(unverified_header['kid'])
+
+    return decode_jwt(token, unverified_header, rsa_key)
+
+
+def get_unverified_header(token):
     unverified_header = jwt.get_unverified_header(token)
 
     # if there is no key id then it is an invalid header
@@ -99,28 +163,26 @@ def verify_decode_jwt(token):
         print('ERROR ==> Authorization malformed')
         raise AuthError('Authorization malformed.', 401)
 
-    # does the compare to check that the key id matches the one provided
-    # then it adds the values of the key(key type, key id, usage)
-    rsa_key = {}
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    return unverified_header
+
 
+def decode_jwt(token, unverified_header, rsa_key):
     # if rsa_key was not found it raises AuthError
     if rsa_key:
         try:
+            if ALGORITHMS is not None and unverified_header.get('alg') not in ALGORITHMS:
+                raise jwt.JWTError('The specified alg value is not allowed')
+
+            # the signature is checked with the cached key object
+            # then jwt.decode only has to validate the claims
+            verify_signature(token, rsa_key)
             payload = jwt.decode(
                 token,
-                rsa_key,
+                '',
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer='https://' + AUTH0_DOMAIN + '/',
+                options={'verify_signature': False}
             )
 
             return payload
@@ -148,6 +210,7 @@ def verify_decode_jwt(token):
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
+        (unless the same token was already verified and is in token_cache)
     it should use the check_permissions method validate claims and check the requested permission
     return the decorator which passes the decoded payload to the decorated method
 '''
@@ -155,10 +218,41 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            start = time.perf_counter()
+            try:
+                with timed('auth_header'):
+                    token = get_token_auth_header()
+
+                verified = token_cache.get(token)
+                if verified is None:
+                    payload = verify_decode_jwt(token)
+                    verified = token_cache.put(token, payload)
+
+                check_permissions(permission, verified.payload, verified.permissions)
+            finally:
+                # The whole check, a cached token skips the key lookup and decode
+                record_phase('auth', time.perf_counter() - start)
+
+            return f(verified.payload, *args, **kwargs)
+        return wrapper
+    return requires_auth_decorator
+
+
+# Same as requires_auth for the async handlers of asgi.py
+# the decorated method gets the payload and the request
+def requires_auth_async(permission=''):
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(request, *args, **kwargs):
+            token = parse_auth_header(request.headers.get('Authorization', None))
+
+            verified = token_cache.get(token)
+            if verified is None:
+                payload = await verify_decode_jwt_async(token)
+                verified = token_cache.put(token, payload)
+
+            check_permissions(permission, verified.payload, verified.permissions)
 
-            return f(payload, *args, **kwargs)
+            return await f(verified.payload, request, *args, **kwargs)
         return wrapper
     return requires_auth_decorator
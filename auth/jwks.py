@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+from jose import jwk
+from jose.exceptions import JWTError
+from jose.utils import base64url_decode
+
+
+'''
+JWKSKeyStore
+    keeps the public keys of a JWKS document parsed and indexed by key id (kid)
+
+    - keys are served from memory while they are younger than ttl
+    - after ttl they are still served (stale-while-revalidate) and a
+      background refresh is started
+    - after stale_ttl they are not trusted anymore and the next lookup
+      refreshes them before answering
+    - an unknown kid triggers one refetch, in case the keys were rotated
+    - refetches are never done more than once per min_refresh_interval,
+      so a flood of tokens with random kids can't hammer the JWKS endpoint
+'''
+class JWKSKeyStore:
+    def __init__(self, fetch, ttl=600, stale_ttl=86400, min_refresh_interval=30):
+        # fetch is a callable that returns the JWKS document as a dict
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url, timeout=5, **kwargs):
+        def fetch():
+            with urlopen(url, timeout=timeout) as response:
+                return json.loads(response.read())
+        return cls(fetch, **kwargs)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        def fetch():
+            with open(path) as jwks_file:
+                return json.load(jwks_file)
+        return cls(fetch, **kwargs)
+
+    def get_key(self, kid):
+        age = self.age()
+
+        # Nothing usable in memory, the caller has to wait for the keys
+        if age is None or age > self.stale_ttl:
+            self.refresh()
+        elif age > self.ttl:
+            self.refresh_in_background()
+
+        key = self._keys.get(kid)
+        # The kid might belong to a key that was added after our last fetch
+        if key is None and self.refresh():
+            key = self._keys.get(kid)
+
+        return key
+
+    async def get_key_async(self, kid):
+        key = self._keys.get(kid)
+        age = self.age()
+        if key is not None and age is not None and age <= self.ttl:
+            return key
+
+        # Getting the key might mean fetching the keys, which blocks,
+        # so it is done in a thread to keep the event loop free
+        return await asyncio.to_thread(self.get_key, kid)
+
+    def age(self):
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    '''
+    refresh()
+        fetches the keys again unless it was attempted recently
+        returns True if the keys were fetched
+    '''
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._last_attempt is not None and \
+                    now - self._last_attempt < self.min_refresh_interval:
+                return False
+            self._last_attempt = now
+
+            try:
+                jwks = self.fetch()
+            except Exception as e:
+                # Keeps serving the keys we already have
+                print(f'ERROR ==> Unable to fetch JWKS: {e}')
+                return False
+
+            self._keys = parse_jwks(jwks)
+            self._fetched_at = time.monotonic()
+            return True
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+'''
+parse_jwks(jwks)
+    builds the public key objects of a JWKS document once
+    so they are not rebuilt from (n, e) for every token
+'''
+def parse_jwks(jwks):
+    keys = {}
+    for key in jwks.get('keys', []):
+        if 'kid' not in key or key.get('kty') != 'RSA':
+            continue
+        try:
+            keys[key['kid']] = jwk.construct(key, key.get('alg', 'RS256'))
+        except Exception as e:
+            print(f'ERROR ==> Skipping unusable JWKS key {key["kid"]}: {e}')
+    return keys
+
+
+'''
+verify_signature(token, key)
+    checks the signature of the token with an already parsed key
+    raises JWTError if it doesn't match
+'''
+def verify_signature(token, key):
+    try:
+        signing_input, encoded_signature = token.encode('utf-8').rsplit(b'.', 1)
+        signature = base64url_decode(encoded_signature)
+    except Exception:
+        raise JWTError('Malformed token.')
+
+    if not key.verify(signing_input, signature):
+        raise JWTError('Signature verification failed.')
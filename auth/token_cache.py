@@ -0,0 +1,72 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+# A verified token, permissions is a frozenset for fast lookups
+CachedToken = namedtuple('CachedToken', ['payload', 'permissions', 'expires_at'])
+
+
+'''
+TokenCache
+    bounded LRU cache of tokens that already passed signature and claims checks
+    so the same bearer token is only verified once until it expires
+
+    - entries are keyed by the sha256 of the token, the raw token is not kept
+    - entries expire at the token exp claim
+    - tokens without exp are never cached
+'''
+class TokenCache:
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        key = hash_token(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token, payload):
+        entry = CachedToken(
+            payload,
+            frozenset(payload.get('permissions', ())),
+            payload.get('exp'))
+
+        if self.max_size <= 0 or not isinstance(entry.expires_at, (int, float)):
+            return entry
+
+        with self._lock:
+            self._entries[hash_token(token)] = entry
+            # Drops the least recently used tokens
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.max_size
+        }
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import json
+import os
+
+from benchmarks.loadgen import run_load
+
+'''
+Compares the sync (app.py) and async (asgi.py) apps under the same load
+
+Start both apps on the same database with the same number of workers
+(with RESPONSE_CACHE_BACKEND=none so app.py doesn't answer from its cache), i.e.
+    gunicorn -w 4 --threads 8 -b 127.0.0.1:8000 app:app
+    uvicorn asgi:app --workers 4 --port 8001
+then run (TOKEN is a bearer token with get:actors and get:movies)
+    python -m benchmarks.asgi_vs_wsgi --concurrency 64,256,1024
+
+It prints requests/sec and p50/p95/p99 latencies for each app and level of
+concurrency, --output also writes them to a JSON file
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark app.py against asgi.py')
+    parser.add_argument('--wsgi-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--paths', default='/actors,/movies,/actors?page=2,/movies?after=5')
+    parser.add_argument('--concurrency', default='64,256,1024')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--token', default=os.environ.get('TOKEN'))
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'Bearer {args.token}'}
+    requests = [('GET', path, None) for path in args.paths.split(',')]
+
+    results = []
+    for concurrency in [int(level) for level in args.concurrency.split(',')]:
+        for name, url in (('wsgi', args.wsgi_url), ('asgi', args.asgi_url)):
+            result = asyncio.run(run_load(url, requests, headers, concurrency, args.duration))
+            result.update(app=name, concurrency=concurrency)
+            results.append(result)
+            print(f"{name:>5} c={concurrency:<5} {result['requests_per_second']:8.1f} req/s  "
+                  f"p50={result['p50_ms'] or 0:7.1f}ms  p99={result['p99_ms'] or 0:7.1f}ms  "
+                  f"errors={result['errors']}  statuses={result['statuses']}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
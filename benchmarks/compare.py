@@ -0,0 +1,89 @@
+import argparse
+import json
+import sys
+
+'''
+Compares two result files of benchmarks/suite.py, i.e. before and after a change
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+prints the requests/sec and p50/p95/p99 of both for each table size and
+endpoint, and marks the endpoints that got slower by more than threshold %
+(exits with 1 if there is any, so it can fail a CI job)
+'''
+
+METRICS = [('requests_per_second', 'req/s', True),
+           ('p50_ms', 'p50', False),
+           ('p95_ms', 'p95', False),
+           ('p99_ms', 'p99', False)]
+
+
+def load(path):
+    with open(path) as results_file:
+        results = json.load(results_file)
+    return results, {(run['rows'], name): result
+                     for run in results['runs'] for name, result in run['results'].items()}
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+'''
+compare(before, after, threshold)
+    returns the lines of the comparison and the endpoints that regressed
+'''
+def compare(before, after, threshold):
+    lines, regressions = [], []
+
+    for key in sorted(before.keys() & after.keys()):
+        rows, name = key
+        cells, regressed = [], False
+        for metric, label, higher_is_better in METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            delta = change(old, new)
+            if delta is None:
+                cells.append(f'{label} -')
+                continue
+            if (-delta if higher_is_better else delta) > threshold:
+                regressed = True
+            cells.append(f'{label} {old:.1f} -> {new:.1f} ({delta:+.1f}%)')
+
+        if regressed:
+            regressions.append(key)
+        lines.append(f"{'!' if regressed else ' '} {rows:>8} {name:<32} " + '  '.join(cells))
+
+    for key in sorted(before.keys() ^ after.keys()):
+        lines.append(f"  {key[0]:>8} {key[1]:<32} only in {'before' if key in before else 'after'}")
+
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='% of change counted as a regression (default 10)')
+    args = parser.parse_args()
+
+    before_meta, before = load(args.before)
+    after_meta, after = load(args.after)
+    print(f"before: {before_meta['commit']} ({before_meta['date']})  "
+          f"after: {after_meta['commit']} ({after_meta['date']})")
+    for setting in ('database', 'server', 'workers', 'concurrency', 'duration', 'env'):
+        if before_meta.get(setting) != after_meta.get(setting):
+            print(f'WARNING ==> {setting} differs: {before_meta.get(setting)} != {after_meta.get(setting)}')
+
+    lines, regressions = compare(before, after, args.threshold)
+    print('\n'.join(lines))
+
+    if regressions:
+        print(f'{len(regressions)} endpoint(s) regressed by more than {args.threshold}%')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
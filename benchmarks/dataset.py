@@ -0,0 +1,31 @@
+from sqlalchemy import create_engine
+
+from database.models import db
+from database.seed import fake_actors, fake_movies
+from database.seed import seed as seed_rows
+
+'''
+Deterministic fake actors and movies for the benchmarks, the same seed
+always gives the same rows so results of two commits can be compared
+the rows come from database/seed.py, like the ones of flask seed
+'''
+
+
+'''
+seed_database(database_url, actors, movies, seed, batch_size, **distributions)
+    drops and recreates the actors and movies tables and fills them
+    distributions are the options of database/seed.py
+    returns the number of rows per second that were inserted
+'''
+def seed_database(database_url, actors, movies, seed=0, batch_size=10000, **distributions):
+    engine = create_engine(database_url)
+    try:
+        db.metadata.drop_all(engine)
+        db.metadata.create_all(engine)
+        results = seed_rows(engine, actors, movies, seed, batch_size, **distributions)
+    finally:
+        engine.dispose()
+
+    rows = sum(count for count, seconds in results.values())
+    return rows / sum(seconds for count, seconds in results.values())
+
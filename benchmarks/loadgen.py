@@ -0,0 +1,127 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+'''
+A small HTTP/1.1 load generator on asyncio, so thousands of concurrent
+clients don't need thousands of threads
+
+Each client keeps one keep-alive connection and sends its requests back to
+back until the duration is over, the latency of every request is recorded
+'''
+
+
+class Client:
+    def __init__(self, host, port, headers):
+        self.host = host
+        self.port = port
+        self.headers = headers
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        lines += [f'{name}: {value}' for name, value in self.headers.items()]
+        if body is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + (body or b''))
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        for line in header_lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding') == 'chunked':
+            data = await self.read_chunked()
+        else:
+            data = await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+
+        return status, data
+
+    async def read_chunked(self):
+        data = b''
+        while True:
+            size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            chunk = await self.reader.readexactly(size + 2)
+            if size == 0:
+                return data
+            data += chunk[:-2]
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.reader = self.writer = None
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(latencies, statuses, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None
+    }
+
+
+'''
+run_load(base_url, requests, headers, concurrency, duration)
+    requests is a list of (method, path, body) the clients go through in turn
+    returns the number of requests, statuses, requests per second and
+    latency percentiles (in milliseconds)
+'''
+async def run_load(base_url, requests, headers, concurrency, duration):
+    url = urlsplit(base_url)
+    latencies = []
+    statuses = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    sent = 0
+
+    async def client_loop():
+        nonlocal errors, sent
+        client = Client(url.hostname, url.port or 80, headers)
+        while time.perf_counter() < deadline:
+            # The clients share the position in the list, so requests that
+            # can only succeed once (i.e. deletes) are not sent twice
+            method, path, body = requests[sent % len(requests)]
+            sent += 1
+            start = time.perf_counter()
+            try:
+                status, _ = await client.request(method, path, body)
+            except Exception:
+                errors += 1
+                await client.close()
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    return summarize(latencies, statuses, errors, time.perf_counter() - start)
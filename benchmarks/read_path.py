@@ -0,0 +1,86 @@
+import argparse
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+from flask import Flask
+
+from benchmarks.dataset import seed_database
+from database.models import Actor, Movie, db, select_columns, setup_db
+
+'''
+Cost of reading rows through ORM instances against plain rows
+
+    python -m benchmarks.read_path --rows 100000
+
+orm: the instances of Model.query turned into dicts with format()
+core: the rows of select_columns(Model) turned into dicts with _asdict()
+prints the time and the peak memory per 1k rows of reading a page of
+--page rows and of going through the whole table like the exports
+'''
+
+
+def orm_page(model, size):
+    items = model.query.order_by(model.id).limit(size).all()
+    return [item.format() for item in items]
+
+
+def core_page(model, size):
+    rows = db.session.execute(select_columns(model).order_by(model.id).limit(size)).all()
+    return [row._asdict() for row in rows]
+
+
+def orm_export(model, size):
+    result = db.session.execute(db.select(model).order_by(model.id).execution_options(yield_per=1000))
+    return sum(len([item.format() for item in partition]) for partition in result.scalars().partitions())
+
+
+def core_export(model, size):
+    result = db.session.execute(
+        select_columns(model).order_by(model.id).execution_options(yield_per=1000))
+    return sum(len([row._asdict() for row in partition]) for partition in result.partitions())
+
+
+def measure(function, model, size, rows, repeat):
+    def run():
+        function(model, size)
+        # Each request has its own session
+        db.session.remove()
+
+    seconds = min(timeit.repeat(run, repeat=repeat, number=1))
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds / rows * 1000 * 1e6, peak / rows * 1000 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ORM and Core read paths')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--page', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f'sqlite:///{os.path.join(directory, "read_path.db")}'
+        seed_database(database_url, args.rows, args.rows)
+
+        app = Flask(__name__)
+        setup_db(app, database_url)
+        with app.app_context():
+            for model in (Actor, Movie):
+                print(f'{model.__tablename__}, microseconds and KiB per 1k rows')
+                for name, function, size in (('orm page', orm_page, args.page),
+                                             ('core page', core_page, args.page),
+                                             ('orm export', orm_export, args.rows),
+                                             ('core export', core_export, args.rows)):
+                    time_per_1k, memory_per_1k = measure(
+                        function, model, size, min(size, args.rows), args.repeat)
+                    print(f'  {name:<12} {time_per_1k:8.0f} us  {memory_per_1k:8.1f} KiB')
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
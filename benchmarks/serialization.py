@@ -0,0 +1,65 @@
+import argparse
+import random
+import timeit
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.dataset import fake_actors, fake_movies
+from database.models import Actor, Movie
+from middleware.json_provider import OrjsonProvider, StdlibJSONProvider, orjson
+
+'''
+Cost of turning a page of rows into the JSON of a list response
+
+    python -m benchmarks.serialization --rows 1000
+
+before: Flask's default provider
+after: the providers of middleware/json_provider.py
+prints the best time per 1k rows of building the format() dicts and of
+writing the response with each provider
+'''
+
+
+def rows(model, fake, count):
+    items = []
+    for row_id, columns in enumerate(fake(count, random.Random(0)), start=1):
+        item = model(**columns)
+        item.id = row_id
+        items.append(item)
+    return items
+
+
+def best_per_1k(function, count, repeat, number):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number / count * 1000 * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON of the list responses')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    variants = [('before', DefaultJSONProvider(app)), ('after (json)', StdlibJSONProvider(app))]
+    if orjson is not None:
+        variants.append(('after (orjson)', OrjsonProvider(app)))
+
+    for table, model, fake in (('actors', Actor, fake_actors), ('movies', Movie, fake_movies)):
+        items = rows(model, fake, args.rows)
+        print(f'{table} ({args.rows} rows), microseconds per 1k rows')
+
+        def build():
+            return [item.format() for item in items]
+        page = build()
+        print(f"  {'format()':<16} {best_per_1k(build, args.rows, args.repeat, args.number):8.0f}")
+
+        for name, provider in variants:
+            def dump():
+                return provider.response({'success': True, table: page})
+            print(f'  {name:<16} {best_per_1k(dump, args.rows, args.repeat, args.number):8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+'''
+Import and boot time of the app, each measured in a new interpreter
+
+    python -m benchmarks.startup --output startup.json --max-boot-ms 1500
+
+import: python -X importtime -c "import app", and the modules that took
+    the longest to import
+boot: importing app, creating the app (app.app), the first request and
+    the second one, and the connections (database or network) opened
+    before the first request, which should be none
+the best time of --repeat runs is kept, it exits with 1 if the boot took
+longer than --max-boot-ms or if something was connected before the first
+request, so it can fail a CI job
+'''
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+'''
+import_times(env)
+    the cumulative import time (in ms) of each module imported by import app
+'''
+def import_times(env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for match in IMPORT_TIME_LINE.finditer(result.stderr):
+        times[match.group(4)] = int(match.group(2)) / 1000
+    return times
+
+
+# Runs in the new interpreter, started with --child
+def boot(warm_up):
+    connections = []
+
+    # Sockets and SQLite files opened by anything from here on
+    def audit(event, args):
+        if event in ('socket.connect', 'sqlite3.connect'):
+            connections.append(f'{event} {args[-1]}')
+    sys.addaudithook(audit)
+
+    timings = {}
+    start = time.perf_counter()
+    import app as module
+    timings['import_ms'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    flask_app = module.app
+    timings['create_app_ms'] = (time.perf_counter() - start) * 1000
+
+    with flask_app.app_context():
+        pool = module.db.engine.pool
+    connected_at_boot = list(connections) + [
+        f'pool {pool.checkedin() + pool.checkedout()} connections'] * bool(
+            pool.checkedin() + pool.checkedout())
+
+    if warm_up:
+        start = time.perf_counter()
+        module.warmup(flask_app)
+        timings['warmup_ms'] = (time.perf_counter() - start) * 1000
+
+    client = flask_app.test_client()
+    headers = {'Authorization': f"Bearer {os.environ['BENCHMARK_TOKEN']}"}
+    for name in ('first_request_ms', 'second_request_ms'):
+        start = time.perf_counter()
+        response = client.get('/actors', headers=headers)
+        timings[name] = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f'GET /actors returned {response.status_code}')
+
+    timings['boot_ms'] = timings['import_ms'] + timings['create_app_ms']
+    print(json.dumps({'timings': timings, 'connected_at_boot': connected_at_boot}))
+
+
+def boot_times(env, warm_up):
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child']
+    if warm_up:
+        command.append('--warmup')
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the import and boot time of the app')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest imports to show')
+    parser.add_argument('--warmup', action='store_true', help='calls warmup() before the first request')
+    parser.add_argument('--max-boot-ms', type=float, help='exits with 1 if the boot takes longer')
+    parser.add_argument('--output', help='the JSON file of the report')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        boot(args.warmup)
+        return
+
+    # Only the parent needs these, the child measures a clean import
+    from benchmarks.dataset import seed_database
+    from benchmarks.suite import API_AUDIENCE, AUTH0_DOMAIN, local_auth
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f'sqlite:///{os.path.join(directory, "startup.db")}'
+        seed_database(database_url, 100, 100)
+        jwks_path, token = local_auth(directory)
+        env = dict(os.environ,
+                   DATABASE_URL=database_url,
+                   JWKS_FILE=jwks_path,
+                   AUTH0_DOMAIN=AUTH0_DOMAIN,
+                   API_AUDIENCE=API_AUDIENCE,
+                   ALGORITHMS='RS256',
+                   BENCHMARK_TOKEN=token)
+
+        imports = {}
+        timings = {}
+        connected_at_boot = []
+        for _ in range(args.repeat):
+            for module, milliseconds in import_times(env).items():
+                imports[module] = min(milliseconds, imports.get(module, milliseconds))
+            run = boot_times(env, args.warmup)
+            for name, milliseconds in run['timings'].items():
+                timings[name] = min(milliseconds, timings.get(name, milliseconds))
+            connected_at_boot = sorted(set(connected_at_boot) | set(run['connected_at_boot']))
+
+    print(f'import app: {imports.get("app", 0):.1f} ms, the slowest imports:')
+    slowest = sorted(((ms, module) for module, ms in imports.items() if module != 'app'), reverse=True)
+    for milliseconds, module in slowest[:args.top]:
+        print(f'  {module:<40} {milliseconds:8.1f} ms')
+    print(f'boot (best of {args.repeat}):')
+    for name, milliseconds in timings.items():
+        print(f'  {name:<20} {milliseconds:8.1f} ms')
+    print(f'connected before the first request: {", ".join(connected_at_boot) or "nothing"}')
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'imports': imports, 'timings': timings,
+                       'connected_at_boot': connected_at_boot}, output_file, indent=2)
+
+    failed = bool(connected_at_boot)
+    if args.max_boot_ms is not None and timings['boot_ms'] > args.max_boot_ms:
+        print(f"ERROR ==> The boot took {timings['boot_ms']:.0f} ms, more than {args.max_boot_ms:.0f} ms")
+        failed = True
+    if connected_at_boot:
+        print('ERROR ==> Something was connected before the first request')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.request import urlopen
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+from jose.utils import base64url_encode
+
+from benchmarks.dataset import seed_database
+from benchmarks.loadgen import run_load
+
+'''
+Load benchmark of every endpoint, without network access
+
+For each table size it
+    - seeds the actors and movies tables (SQLite by default, or the
+      database of --database-url, its tables are dropped and recreated)
+    - signs a token with a local RSA key and serves the public key to the
+      app through JWKS_FILE, so no Auth0 tenant is needed
+    - starts the app and drives each endpoint with --concurrency clients
+      for --duration seconds
+and writes the requests/sec and p50/p95/p99 latencies of every endpoint
+to a JSON file, compare two of them with benchmarks/compare.py
+
+    python -m benchmarks.suite --rows 1000,100000 --output before.json
+    python -m benchmarks.suite --rows 1000,100000 --output after.json
+    python -m benchmarks.compare before.json after.json
+'''
+
+AUTH0_DOMAIN = 'benchmark.local'
+API_AUDIENCE = 'benchmark'
+KEY_ID = 'benchmark-key'
+PERMISSIONS = ['get:actors', 'get:movies', 'post:actor', 'post:movie',
+               'delete:actor', 'delete:movie', 'patch:actor', 'patch:movie']
+
+SEARCH_TERMS = ['hans', 'tom', 'stone', 'reev', 'emma d']
+MOVIE_SEARCH_TERMS = ['lion', 'king', 'dark star', 'ret', 'iron game']
+
+
+'''
+local_auth(directory)
+    writes a JWKS with a new RSA public key to directory
+    returns the path of the JWKS and a token signed with the private key
+'''
+def local_auth(directory):
+    key = RSA.generate(2048)
+
+    def encode(number):
+        return base64url_encode(number.to_bytes((number.bit_length() + 7) // 8, 'big')).decode()
+
+    jwks_path = os.path.join(directory, 'jwks.json')
+    with open(jwks_path, 'w') as jwks_file:
+        json.dump({'keys': [{'kty': 'RSA', 'kid': KEY_ID, 'use': 'sig', 'alg': 'RS256',
+                             'n': encode(key.n), 'e': encode(key.e)}]}, jwks_file)
+
+    now = int(time.time())
+    token = jwt.encode({
+        'iss': f'https://{AUTH0_DOMAIN}/',
+        'aud': API_AUDIENCE,
+        'iat': now,
+        'exp': now + 24 * 3600,
+        'permissions': PERMISSIONS
+    }, key.export_key().decode(), algorithm='RS256', headers={'kid': KEY_ID})
+
+    return jwks_path, token
+
+
+def body(value):
+    return json.dumps(value).encode()
+
+
+'''
+scenarios(rows)
+    the requests of each benchmarked endpoint, the clients go through them in
+    turn, tables have `rows` actors and movies when the reads start
+    the writes run after the reads and the deletes last
+'''
+def scenarios(rows):
+    middle_page = max(1, rows // 20)
+    reads = {}
+    for table, search_terms, filters in (
+            ('actors', SEARCH_TERMS, 'gender=Female&min_age=30&max_age=40&sort=-age,name'),
+            ('movies', MOVIE_SEARCH_TERMS, 'released_after=1990-01-01&sort=-release_date')):
+        reads.update({
+            f'GET /{table}': [('GET', f'/{table}', None)],
+            f'GET /{table}?page=<middle>': [('GET', f'/{table}?page={middle_page}', None)],
+            f'GET /{table}?after=<middle>': [('GET', f'/{table}?after={rows // 2}', None)],
+            f'GET /{table}?<filters>': [('GET', f'/{table}?{filters}', None)],
+            f'GET /{table}/search': [('GET', f'/{table}/search?q={term.replace(" ", "+")}', None)
+                                     for term in search_terms],
+            f'GET /{table}/export': [('GET', f'/{table}/export', None)]
+        })
+
+    # Kept out of the mixed reads so they stay comparable with older results
+    middle_ids = range(rows // 2, rows // 2 + 100)
+    cast_reads = {
+        'GET /movies?embed=actors': [('GET', '/movies?embed=actors&limit=100', None)],
+        'GET /actors?embed=movies': [('GET', '/actors?embed=movies&limit=100', None)],
+        'GET /movies/<id>/actors': [('GET', f'/movies/{i}/actors', None) for i in middle_ids],
+        'GET /actors/<id>/movies': [('GET', f'/actors/{i}/movies', None) for i in middle_ids]
+    }
+
+    updated = range(1, min(rows, 1000) + 1)
+    # Every delete needs its own row, they start from the last ones
+    deleted = range(rows, max(rows // 2, rows - 100000), -1)
+
+    writes = {
+        'POST /actors': [('POST', '/actors', body({'name': 'Bench Actor', 'age': 30, 'gender': 'Female'}))],
+        'POST /movies': [('POST', '/movies', body({'title': 'Bench Movie', 'release_date': '2020-01-01'}))],
+        'POST /actors/bulk': [('POST', '/actors/bulk', body(
+            [{'name': f'Bench Actor {i}', 'age': 20 + i % 50, 'gender': 'Male'} for i in range(100)]))],
+        'POST /movies/bulk': [('POST', '/movies/bulk', body(
+            [{'title': f'Bench Movie {i}', 'release_date': '2021-06-01'} for i in range(100)]))],
+        'PATCH /actors/<id>': [('PATCH', f'/actors/{i}', body({'age': 40 + i % 30})) for i in updated],
+        'PATCH /movies/<id>': [('PATCH', f'/movies/{i}', body({'title': f'Renamed {i}'})) for i in updated],
+        'DELETE /actors/<id>': [('DELETE', f'/actors/{i}', None) for i in deleted],
+        'DELETE /movies/<id>': [('DELETE', f'/movies/{i}', None) for i in deleted]
+    }
+
+    return {
+        'GET /health': [('GET', '/health', None)],
+        **reads,
+        'mixed reads': [request for requests in reads.values() for request in requests
+                        if '/export' not in request[1]],
+        **cast_reads,
+        **writes,
+        'GET /metrics': [('GET', '/metrics', None)]
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(server, port, workers):
+    if server == 'gunicorn':
+        return ['gunicorn', '-w', str(workers), '--threads', '8', '-b', f'127.0.0.1:{port}', 'app:app']
+    if server == 'uvicorn':
+        # Only has the CRUD endpoints, the others answer 404
+        return ['uvicorn', 'asgi:app', '--workers', str(workers), '--port', str(port),
+                '--log-level', 'warning']
+    return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+            '--with-threads', '--no-reload', '--no-debugger']
+
+
+@contextmanager
+def running_app(server, port, workers, env, timeout=300):
+    process = subprocess.Popen(server_command(server, port, workers), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Waits for the app (and its search indexes) to be ready
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'The app exited with code {process.returncode}')
+            try:
+                with urlopen(f'http://127.0.0.1:{port}/health', timeout=1):
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('The app did not start in time')
+                time.sleep(0.2)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every endpoint of the API')
+    parser.add_argument('--rows', default='1000',
+                        help='comma separated sizes of the actors and movies tables, i.e. 1000,1000000')
+    parser.add_argument('--database-url',
+                        help='the database to seed and benchmark (default: a temporary SQLite file)')
+    parser.add_argument('--server', choices=['flask', 'gunicorn', 'uvicorn'], default='flask')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cast-size', type=int, default=5, help='actors cast in each movie')
+    parser.add_argument('--only', help='comma separated words, only runs the endpoints containing one')
+    parser.add_argument('--env', action='append', default=[],
+                        help='KEY=VALUE passed to the app, i.e. --env RESPONSE_CACHE_BACKEND=none')
+    parser.add_argument('--output', help='the JSON file of the results')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    runs = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f'sqlite:///{os.path.join(directory, "benchmark.db")}'
+        jwks_path, token = local_auth(directory)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        env = dict(os.environ,
+                   DATABASE_URL=database_url,
+                   JWKS_FILE=jwks_path,
+                   AUTH0_DOMAIN=AUTH0_DOMAIN,
+                   API_AUDIENCE=API_AUDIENCE,
+                   ALGORITHMS='RS256')
+        env.update(setting.split('=', 1) for setting in args.env)
+
+        for rows in [int(size) for size in args.rows.split(',')]:
+            print(f'Seeding {rows} actors and movies...')
+            rate = seed_database(database_url, rows, rows, seed=args.seed, cast_size=args.cast_size)
+            print(f'  {rate:.0f} rows/s')
+
+            results = {}
+            port = free_port()
+            with running_app(args.server, port, args.workers, env) as base_url:
+                for name, requests in scenarios(rows).items():
+                    if args.only and not any(word in name for word in args.only.split(',')):
+                        continue
+                    result = asyncio.run(run_load(
+                        base_url, requests, headers, args.concurrency, args.duration))
+                    results[name] = result
+                    print(f"  {name:<32} {result['requests_per_second']:9.1f} req/s  "
+                          f"p50={result['p50_ms'] or 0:8.1f}ms  p95={result['p95_ms'] or 0:8.1f}ms  "
+                          f"p99={result['p99_ms'] or 0:8.1f}ms  statuses={result['statuses']}")
+
+            runs.append({'rows': rows, 'results': results})
+
+    output = args.output or os.path.join('benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump({
+            'commit': commit,
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': (args.database_url or 'sqlite').split(':', 1)[0],
+            'server': args.server,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'seed': args.seed,
+            'env': args.env,
+            'runs': runs
+        }, output_file, indent=2, sort_keys=True)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+from sqlalchemy import text
+
+from database.models import db, on_change
+
+# How the totals are counted when the request doesn't say (?count=)
+#   exact: SELECT count(*) on every request
+#   estimate: the row estimate of the Postgres planner (exact on other databases)
+#   cached: a counter kept in memory and updated on every commit
+COUNT_MODES = ('exact', 'estimate', 'cached')
+COUNT_MODE = os.environ.get('COUNT_MODE', 'exact')
+
+# How often (in seconds) the cached counters are recounted, to pick up the
+# changes the change listeners of this worker don't see
+COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))
+
+
+'''
+count_rows(model, mode, filters)
+    returns the number of rows of the model table
+    or the number of rows matching the filters (always counted exactly)
+'''
+def count_rows(model, mode=None, filters=None):
+    mode = mode or COUNT_MODE
+
+    if filters:
+        return exact_count(model, filters)
+
+    if mode == 'estimate':
+        estimate = estimate_rows(model)
+        if estimate is not None:
+            return estimate
+
+    if mode == 'cached':
+        return row_counter.get(model)
+
+    return exact_count(model)
+
+
+def exact_count(model, filters=()):
+    return db.session.scalar(
+        db.select(db.func.count()).select_from(model).where(*filters))
+
+
+def estimate_rows(model):
+    # Only Postgres keeps a row estimate we can read
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return None
+
+    estimate = db.session.scalar(
+        # Only reads, so it doesn't keep the rest of a GET off the replicas
+        text('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)')
+        .execution_options(read_only=True),
+        {'table': model.__tablename__})
+
+    # reltuples is -1 (or 0 on older versions) until the table is analyzed
+    if estimate is None or estimate <= 0:
+        return None
+    return estimate
+
+
+'''
+RowCounter
+    counts of each table kept in memory
+    they are adjusted after each commit that adds or deletes rows
+    and recounted every ttl seconds
+'''
+class RowCounter:
+    def __init__(self, ttl=COUNT_CACHE_TTL):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        tablename = model.__tablename__
+        entry = self._counts.get(tablename)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        count = exact_count(model)
+        with self._lock:
+            self._counts[tablename] = [count, time.monotonic()]
+        return count
+
+    def apply(self, tablename, changes):
+        delta = 0
+        for old, new in changes:
+            if old is None:
+                delta += 1
+            elif new is None:
+                delta -= 1
+
+        with self._lock:
+            if delta and tablename in self._counts:
+                self._counts[tablename][0] += delta
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+row_counter = RowCounter()
+
+@on_change
+def update_row_counter(tablename, changes):
+    row_counter.apply(tablename, changes)
@@ -0,0 +1,111 @@
+import os
+import re
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Adds the X-Query-Count and X-DB-Time (milliseconds) headers to every response
+QUERY_STATS_HEADERS = os.environ.get('QUERY_STATS_HEADERS', 'false').lower() == 'true'
+# Statements slower than this (in milliseconds) are logged with their parameters, 0 turns it off
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# A statement run this many times in one request is reported as a likely N+1, 0 turns it off
+REPEATED_QUERY_THRESHOLD = int(os.environ.get('REPEATED_QUERY_THRESHOLD', 5))
+
+# How much of the parameters is printed in the slow query log
+MAX_LOGGED_PARAMETERS = 500
+
+
+'''
+RequestStats
+    what the database did for the current request (or app context)
+'''
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        self.fingerprints[fingerprint(statement)] += 1
+
+    # The statements run at least threshold times, most repeated first
+    def repeated(self, threshold=REPEATED_QUERY_THRESHOLD):
+        if threshold <= 0:
+            return []
+        return [(statement, count) for statement, count in self.fingerprints.most_common()
+                if count >= threshold]
+
+
+def request_stats():
+    if 'db_stats' not in g:
+        g.db_stats = RequestStats()
+    return g.db_stats
+
+
+'''
+fingerprint(statement)
+    the statement without its values, so the same query with other
+    parameters (or a longer IN list) has the same fingerprint
+'''
+def fingerprint(statement):
+    statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    statement = re.sub(r'%\(\w+\)s|\$\d+|(?<!:):\w+|%s|\b\d+(?:\.\d+)?\b', '?', statement)
+    statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', statement)
+    return ' '.join(statement.split())
+
+
+def truncate(value, length=MAX_LOGGED_PARAMETERS):
+    text = repr(value)
+    return text if len(text) <= length else text[:length] + '...'
+
+
+# Listens on the Engine class so every engine (and replica) is measured
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    if has_app_context():
+        request_stats().record(statement, elapsed)
+
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        print(f'WARNING ==> Slow query ({elapsed * 1000:.1f} ms): '
+              f'{" ".join(statement.split())} parameters: {truncate(parameters)}')
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(exception_context):
+    # after_cursor_execute is not called for failed statements
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+'''
+init_query_stats(app)
+    reports what the database did for each request of the app
+    (the headers are only added if QUERY_STATS_HEADERS is set)
+'''
+def init_query_stats(app):
+    @app.after_request
+    def report_query_stats(response):
+        stats = request_stats()
+
+        if QUERY_STATS_HEADERS:
+            response.headers['X-Query-Count'] = str(stats.queries)
+            response.headers['X-DB-Time'] = f'{stats.db_time * 1000:.2f}'
+
+        for statement, count in stats.repeated():
+            print(f'WARNING ==> Possible N+1: the same query ran {count} times '
+                  f'in {request.method} {request.path}: {statement}')
+
+        return response
@@ -1,28 +1,36 @@
 import json
 import os
+from datetime import date
 
-from dotenv import load_dotenv
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, delete, event, insert, inspect, update
+from sqlalchemy.orm import Session, validates
 
-load_dotenv()
+from database.pool import engine_options
+from database.routing import RoutingSession, replica_binds
 
 database_path = os.environ.get('DATABASE_URL')
 
-db = SQLAlchemy()
+# The session sends the reads of GET requests to the replicas, if there are any
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    replica_urls are the read replicas (DATABASE_REPLICA_URLS by default)
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_urls=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Pool size, timeout, recycle and pre-ping come from the environment
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.config["SQLALCHEMY_BINDS"] = replica_binds(replica_urls)
     db.app = app
     migrate = Migrate(app, db)
+    # No connection or DDL here, the schema is created by the migrations
+    # (flask db upgrade) and the pool connects on the first query
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
 
 '''
 db_drop_and_create_all()
@@ -30,8 +38,9 @@ db_drop_and_create_all()
     can be used to initialize a clean database
 '''
 def db_drop_and_create_all():
-    db.drop_all()
-    db.create_all()
+    # Only on the primary, the replicas get it from there
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
 
     # Add some initial data
     actors = [
@@ -76,14 +85,270 @@ def db_drop_and_create_all():
     for movie in movies:
         movie.insert()
 
+    # Some of the actors of the movies
+    for movie, actor_indexes in ((4, [1]), (5, [14]), (9, [2, 3, 10]), (15, [2, 3, 10])):
+        movies[movie].actors.extend(actors[index] for index in actor_indexes)
+    db.session.commit()
+
+
+'''
+Change listeners
+    functions called after every commit that changed actors or movies
+    called as listener(tablename, changes) where changes is a list of
+    (old, new) rows in their format() form, old is None for inserted rows
+    and new is None for deleted rows
+'''
+change_listeners = []
+
+def on_change(listener):
+    change_listeners.append(listener)
+    return listener
+
+'''
+record_changes(tablename, changes)
+    for changes made without the ORM (i.e. bulk statements)
+    they are sent to the listeners with the next commit
+'''
+def record_changes(tablename, changes, session=None):
+    session = session or db.session
+    session.info.setdefault('changes', {}).setdefault(tablename, []).extend(changes)
+
+def previous_format(item):
+    # The row as it was before the pending changes
+    old = item.format()
+    for attr in inspect(item).attrs:
+        if attr.key in old and attr.history.deleted:
+            old[attr.key] = attr.history.deleted[0]
+    return old
+
+@event.listens_for(Session, 'after_flush')
+def collect_changes(session, flush_context):
+    changes = []
+    for item in session.new:
+        if hasattr(item, 'format'):
+            changes.append((item, (None, item.format())))
+    for item in session.dirty:
+        if hasattr(item, 'format') and session.is_modified(item):
+            changes.append((item, (previous_format(item), item.format())))
+    for item in session.deleted:
+        if hasattr(item, 'format'):
+            changes.append((item, (previous_format(item), None)))
+
+    for item, change in changes:
+        record_changes(item.__tablename__, [change], session)
+
+@event.listens_for(Session, 'after_commit')
+def send_changes(session):
+    pending = session.info.pop('changes', {})
+    for tablename, changes in pending.items():
+        for listener in change_listeners:
+            try:
+                listener(tablename, changes)
+            except Exception as e:
+                # A listener must never fail a commit that already happened
+                print(f'ERROR ==> Change listener {listener.__name__} failed: {e}')
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('changes', None)
+
+'''
+bulk_insert(model, rows)
+    inserts many rows (list of column dicts) in one transaction
+    using a single executemany statement instead of one INSERT per row
+    returns the new ids in the same order as the rows
+'''
+def bulk_insert(model, rows):
+    try:
+        ids = db.session.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True),
+            rows).all()
+        record_changes(model.__tablename__, [
+            (None, dict(row, id=row_id)) for row, row_id in zip(rows, ids)])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return ids
+
+'''
+bulk_delete(model, ids)
+    deletes the rows of ids with a single DELETE in one transaction
+    returns the ids that were deleted (the others don't exist)
+'''
+def bulk_delete(model, ids):
+    table = model.__table__
+    try:
+        # Not every database enforces the ON DELETE CASCADE (i.e. SQLite)
+        db.session.execute(delete(cast).where(cast_columns(model)[0].in_(ids)))
+        # RETURNING gives the deleted rows for the change listeners
+        deleted = db.session.execute(
+            delete(table).where(table.c.id.in_(ids)).returning(*table.columns)).all()
+        record_changes(table.name, [(row._asdict(), None) for row in deleted])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return [row.id for row in deleted]
+
+'''
+bulk_update(model, changes)
+    changes maps ids to the columns to change, i.e. {1: {'age': 40}}
+    they are all done by a single UPDATE (a CASE on the id for each
+    column) in one transaction
+    returns the updated rows in their format() form
+'''
+def bulk_update(model, changes):
+    table = model.__table__
+    try:
+        # Locks the rows and keeps them as they were for the change listeners
+        old = {row.id: row._asdict() for row in db.session.execute(
+            select_columns(model).where(table.c.id.in_(list(changes))).with_for_update())}
+
+        values = {}
+        for name in {name for fields in changes.values() for name in fields}:
+            whens = {row_id: fields[name] for row_id, fields in changes.items()
+                     if name in fields and row_id in old}
+            if whens:
+                values[name] = case(whens, value=table.c.id, else_=table.c[name])
+
+        updated = []
+        if values:
+            updated = [row._asdict() for row in db.session.execute(
+                update(table).where(table.c.id.in_(list(old)))
+                .values(values).returning(*table.columns))]
+            record_changes(table.name, [(old[row['id']], row) for row in updated])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return sorted(updated, key=lambda row: row['id'])
+
+'''
+set_cast(movie_id, actor_ids)
+    makes actor_ids the cast of the movie, adding and removing only the
+    rows that changed, in one transaction
+'''
+def set_cast(movie_id, actor_ids):
+    try:
+        old = set(db.session.scalars(
+            db.select(cast.c.actor_id).where(cast.c.movie_id == movie_id)))
+        new = set(actor_ids)
+
+        if old - new:
+            db.session.execute(delete(cast).where(
+                cast.c.movie_id == movie_id, cast.c.actor_id.in_(old - new)))
+        if new - old:
+            db.session.execute(insert(cast), [
+                {'movie_id': movie_id, 'actor_id': actor_id} for actor_id in sorted(new - old)])
+        record_changes(cast.name, [
+            ({'movie_id': movie_id, 'actor_id': actor_id}, None) for actor_id in old - new
+        ] + [
+            (None, {'movie_id': movie_id, 'actor_id': actor_id}) for actor_id in new - old
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+'''
+cast_columns(model)
+    the column of the cast table that points to the model and the one that
+    points to the other side, i.e. (movie_id, actor_id) for Movie
+'''
+def cast_columns(model):
+    if model.__tablename__ == 'movies':
+        return cast.c.movie_id, cast.c.actor_id
+    return cast.c.actor_id, cast.c.movie_id
+
+'''
+select_columns(model)
+    a SELECT of the columns of the model that skips the ORM, it returns
+    rows (named tuples) instead of instances so there is no identity map
+    or change tracking to pay for, meant for the read only endpoints
+    row._asdict() is the same as the format() of the instance
+    fields (column names) narrows the SELECT to these columns, the id is
+    always selected
+'''
+def select_columns(model, fields=None):
+    if fields is None:
+        return db.select(*model.__table__.columns)
+    return db.select(*(column for column in model.__table__.columns
+                       if column.name == 'id' or column.name in fields))
+
+'''
+narrow(item, fields)
+    only the fields (and the id) of an item in its format() form
+'''
+def narrow(item, fields):
+    if fields is None:
+        return item
+    return {name: value for name, value in item.items() if name == 'id' or name in fields}
+
+'''
+stream_all(model, batch_size)
+    goes through the whole table in id order batch_size rows at a time
+    on Postgres the rows are read from a server-side cursor, so only one
+    batch is in memory at once
+    yields lists of rows in their format() form (only the fields if given)
+'''
+def stream_all(model, batch_size=1000, fields=None):
+    result = db.session.execute(
+        select_columns(model, fields).order_by(model.id)
+        .execution_options(yield_per=batch_size))
+
+    for partition in result.partitions():
+        yield [row._asdict() for row in partition]
+
+
+'''
+cast
+    which actors play in which movies
+    the primary key (movie_id, actor_id) finds the actors of a movie and the
+    index (actor_id, movie_id) the movies of an actor, both without reading
+    the table itself
+'''
+cast = db.Table(
+    'cast',
+    db.Column('movie_id', db.Integer, db.ForeignKey('movies.id', ondelete='CASCADE'),
+              primary_key=True),
+    db.Column('actor_id', db.Integer, db.ForeignKey('actors.id', ondelete='CASCADE'),
+              primary_key=True),
+    db.Index('ix_cast_actor_id_movie_id', 'actor_id', 'movie_id'),
+)
+
+
+'''
+generations
+    a counter per name bumped to make every worker load its in-memory copy
+    of some data again (i.e. flask rebuild-stats), kept in the database as
+    it is the one thing all the workers share
+'''
+generations = db.Table(
+    'generations',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('generation', db.Integer, nullable=False, default=0),
+)
+
 
 class Actor(db.Model):
     __tablename__ = 'actors'
+    # For the filters and sorting of GET /actors
+    __table_args__ = (
+        db.Index('ix_actors_gender_age', 'gender', 'age'),
+        db.Index('ix_actors_age', 'age'),
+        db.Index('ix_actors_name', 'name'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     age = db.Column(db.Integer, nullable=False)
     gender = db.Column(db.String(10), nullable=False)
+    # Loaded one actor at a time unless the query asks for selectinload
+    movies = db.relationship('Movie', secondary=cast, back_populates='actors')
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -101,26 +366,43 @@ class Actor(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def format(self):
-        return {
+    def format(self, fields=None):
+        return narrow({
             'id': self.id,
             'name': self.name,
             'age': self.age,
             'gender': self.gender
-        }
+        }, fields)
 
 
 class Movie(db.Model):
     __tablename__ = 'movies'
+    # For the filters and sorting of GET /movies
+    __table_args__ = (
+        db.Index('ix_movies_release_date', 'release_date'),
+        db.Index('ix_movies_title', 'title'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     release_date = db.Column(db.Date, nullable=False)
+    actors = db.relationship('Actor', secondary=cast, back_populates='movies')
 
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
+    # Takes ISO dates as dates, not every database parses strings (i.e. SQLite)
+    @validates('release_date')
+    def validate_release_date(self, key, value):
+        if isinstance(value, str):
+            try:
+                return date.fromisoformat(value)
+            except ValueError:
+                # Other formats are left for the database to parse
+                pass
+        return value
+
     def insert(self):
         db.session.add(self)
         db.session.commit()
@@ -132,9 +414,9 @@ class Movie(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def format(self):
-        return {
+    def format(self, fields=None):
+        return narrow({
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date
-        }
+        }, fields)
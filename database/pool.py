@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Connection pool settings of each worker
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds after which a connection is replaced, before the server drops it
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# Checks connections with a cheap query before using them
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+
+
+'''
+MeteredQueuePool
+    the default SQLAlchemy pool that also measures how long
+    each checkout waited for a connection
+'''
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # Keeps the stats when the pool is recreated (i.e. after a disconnect)
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+class WaitStats:
+    def __init__(self, window=1000):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # The most recent waits, for the percentiles
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._recent.append(wait)
+
+    def report(self):
+        with self._lock:
+            recent = sorted(self._recent)
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(len(recent) * p))] * 1000
+
+        return {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'total_wait_ms': self.total_wait * 1000,
+            'max_wait_ms': self.max_wait * 1000,
+            'p50_wait_ms': percentile(0.50),
+            'p95_wait_ms': percentile(0.95),
+            'p99_wait_ms': percentile(0.99)
+        }
+
+
+'''
+engine_options(database_path)
+    the SQLALCHEMY_ENGINE_OPTIONS for the database
+    SQLite keeps its own pool as it has no server to share connections with
+'''
+def engine_options(database_path):
+    if not database_path or database_path.startswith('sqlite'):
+        return {}
+
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            # Negative while the pool is not full yet
+            'overflow': pool.overflow(),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout(),
+            'recycle': pool._recycle,
+            'pre_ping': pool._pre_ping
+        })
+    if isinstance(pool, MeteredQueuePool):
+        status['wait'] = pool.wait_stats.report()
+
+    return status
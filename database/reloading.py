@@ -0,0 +1,100 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import insert, update
+
+from database.models import db, generations
+
+'''
+Data a worker keeps in memory from the database (the search indexes, the
+statistics)
+
+It is loaded on the first read, then kept up to date by the change
+listeners of the worker. After ttl seconds it is loaded again, to pick up
+the changes made by other workers or outside the app (i.e. flask seed),
+and when its generation (if it has one) was bumped by another process
+'''
+
+
+'''
+get_generation(name) and bump_generation(name)
+    the counter of the generations table, 0 until it is first bumped
+'''
+def get_generation(name):
+    return db.session.scalar(
+        db.select(generations.c.generation).where(generations.c.name == name)) or 0
+
+
+def bump_generation(name):
+    result = db.session.execute(
+        update(generations).where(generations.c.name == name)
+        .values(generation=generations.c.generation + 1))
+    if result.rowcount == 0:
+        db.session.execute(insert(generations).values(name=name, generation=1))
+    db.session.commit()
+
+
+'''
+Reloadable
+    base of the in-memory copies, the subclasses implement load(), which
+    reads the data and then calls loaded(generation)
+    name is used in the error messages, generation_name is the name of its
+    generation, None if it has none
+'''
+class Reloadable:
+    name = 'data'
+    generation_name = None
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.built_at = None
+        self.generation = None
+        self._lock = threading.RLock()
+        self._rebuilding = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def current_generation(self):
+        if self.generation_name is None:
+            return None
+        return get_generation(self.generation_name)
+
+    def loaded(self, generation):
+        # Called with the lock held
+        self.built_at = time.monotonic()
+        self.generation = generation
+
+    '''
+    refresh()
+        to be called before each read, within an app context
+        loads the data if it never was or if its generation changed, starts
+        a rebuild in the background if it is stale and keeps answering from
+        the current data until the new one is loaded
+    '''
+    def refresh(self):
+        if self.built_at is None or self.generation != self.current_generation():
+            self.load()
+        elif self.is_stale():
+            self.rebuild_in_background(current_app._get_current_object())
+
+    def is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.ttl
+
+    def rebuild_in_background(self, app):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                with app.app_context():
+                    self.load()
+            except Exception as e:
+                print(f'ERROR ==> Unable to rebuild the {self.name}: {e}')
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=run, daemon=True).start()
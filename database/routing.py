@@ -0,0 +1,173 @@
+import itertools
+import os
+import threading
+import time
+
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.sql import Executable, Select
+
+from database.pool import engine_options
+
+'''
+Read replicas
+
+With DATABASE_REPLICA_URLS set (comma separated database URLs) the
+queries of GET requests go to a replica, everything else to the primary
+(DATABASE_URL):
+    - a request keeps the replica it started reading from
+    - once a request writes (a flush or an INSERT/UPDATE/DELETE) or locks
+      rows (SELECT ... FOR UPDATE), it stays on the primary so it reads
+      what it wrote
+    - a replica that fails is skipped for REPLICA_RETRY_INTERVAL seconds
+      and the query that failed is run again on the primary
+    - the responses kept by the response cache are read from the primary,
+      a lagging replica would keep a stale body cached until it expires
+    - a text() statement counts as a write unless it is marked with
+      execution_options(read_only=True)
+the replicas lag behind the primary, a GET right after a write (in
+another request) may not see it yet
+'''
+
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# round_robin: each replica in turn
+# least_connections: the replica with the fewest connections in use by this worker
+REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY', 'round_robin')
+REPLICA_RETRY_INTERVAL = float(os.environ.get('REPLICA_RETRY_INTERVAL', 30))
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+'''
+replica_binds(urls)
+    the SQLALCHEMY_BINDS of the replicas (replica_0, replica_1...), the
+    replicas of DATABASE_REPLICA_URLS if urls is None
+'''
+def replica_binds(urls=None):
+    urls = DATABASE_REPLICA_URLS if urls is None else urls
+    return {f'replica_{index}': {'url': url, **engine_options(url)}
+            for index, url in enumerate(urls)}
+
+
+'''
+ReplicaSet
+    chooses the replica of a request and keeps track of the failed ones
+'''
+class ReplicaSet:
+    def __init__(self, strategy=REPLICA_STRATEGY, retry_interval=REPLICA_RETRY_INTERVAL):
+        self.strategy = strategy
+        self.retry_interval = retry_interval
+        self._failed_until = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    '''
+    choose(engines)
+        the bind key of the replica to read from, None if there is no
+        healthy replica
+    '''
+    def choose(self, engines):
+        now = time.monotonic()
+        healthy = [key for key in sorted(key for key in engines if is_replica(key))
+                   if self._failed_until.get(key, 0) <= now]
+        if not healthy:
+            return None
+
+        # Starts from the next replica each time, so ties are spread out
+        turn = next(self._turn) % len(healthy)
+        healthy = healthy[turn:] + healthy[:turn]
+        if self.strategy == 'least_connections':
+            return min(healthy, key=lambda key: engines[key].pool.checkedout())
+        return healthy[0]
+
+    def mark_failed(self, key):
+        with self._lock:
+            self._failed_until[key] = time.monotonic() + self.retry_interval
+
+    def clear(self):
+        with self._lock:
+            self._failed_until.clear()
+
+    def status(self, engines):
+        now = time.monotonic()
+        return {key: {'healthy': self._failed_until.get(key, 0) <= now}
+                for key in sorted(key for key in engines if is_replica(key))}
+
+
+replicas = ReplicaSet()
+
+
+def is_replica(key):
+    return key is not None and key.startswith('replica_')
+
+
+def is_write(clause):
+    # Anything but a plain SELECT (INSERT, UPDATE, DELETE, text()...)
+    if clause is None:
+        return False
+    if isinstance(clause, Select):
+        return clause._for_update_arg is not None
+    return not (isinstance(clause, Executable)
+                and clause.get_execution_options().get('read_only', False))
+
+
+'''
+use_primary(session)
+    the rest of the request reads from the primary
+'''
+def use_primary(session):
+    session.info['primary'] = True
+
+
+'''
+RoutingSession
+    the session of db (database/models.py), sends the reads of GET
+    requests to a replica and the rest to the primary
+'''
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.reads_from_replica(clause):
+            engines = self._db.engines
+            key = self.info.get('replica')
+            if key is None:
+                key = self.info['replica'] = replicas.choose(engines)
+            if key is not None:
+                return engines[key]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def reads_from_replica(self, clause):
+        if self.info.get('primary'):
+            return False
+        if self._flushing or is_write(clause):
+            # Everything after a write reads from the primary
+            self.info['primary'] = True
+            return False
+        return has_request_context() and request.method in READ_METHODS
+
+    def execute(self, *args, **kwargs):
+        return self.with_failover(super().execute, *args, **kwargs)
+
+    def scalar(self, *args, **kwargs):
+        return self.with_failover(super().scalar, *args, **kwargs)
+
+    def scalars(self, *args, **kwargs):
+        return self.with_failover(super().scalars, *args, **kwargs)
+
+    def with_failover(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except DBAPIError as e:
+            replica = self.info.get('replica')
+            if replica is None or self.info.get('primary') or \
+                    not (isinstance(e, OperationalError) or e.connection_invalidated):
+                raise
+
+            print(f'WARNING ==> Replica {replica} failed, reading from the primary: {e.orig}')
+            replicas.mark_failed(replica)
+            # Nothing was written, the request only read from the replica so far
+            self.rollback()
+            self.info['primary'] = True
+            return method(*args, **kwargs)
@@ -0,0 +1,223 @@
+import heapq
+import os
+import re
+from collections import defaultdict
+
+from sqlalchemy import func, literal
+
+from database.models import Actor, Movie, db, on_change, select_columns
+from database.reloading import Reloadable
+
+# memory: an inverted index of trigrams kept by the app (the default)
+# database: LIKE queries answered by the pg_trgm indexes of the migrations
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'memory')
+
+# How often (in seconds) the index is rebuilt from the database
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', 300))
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', text.casefold()))
+
+'''
+trigrams(text)
+    the trigrams of every word padded like pg_trgm does ("  word ")
+    so the first letters of a word also have trigrams ("  w", " wo")
+'''
+def trigrams(text):
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def query_trigrams(query):
+    grams = set()
+    words = query.split()
+    for position, word in enumerate(words, 1):
+        if len(word) >= 3:
+            grams.update(word[i:i + 3] for i in range(len(word) - 2))
+        elif position == len(words):
+            # Too short to have an inner trigram, after a space it can
+            # only be a word prefix
+            grams.update(f'  {word}'[i:i + 3] for i in range(len(word)))
+        # A short word before the last one may be the end of a word
+        # ("k re" in "frank reed"), match_rank checks the candidates
+    return grams
+
+
+'''
+SearchIndex
+    inverted index from trigrams to the ids of the rows containing them
+    answers prefix and substring searches on one text column
+'''
+class SearchIndex(Reloadable):
+    def __init__(self, model, field, ttl=SEARCH_INDEX_TTL):
+        super().__init__(ttl)
+        self.model = model
+        self.field = field
+        self.name = f'{model.__tablename__} search index'
+        self._texts = {}
+        self._postings = defaultdict(set)
+
+    def build(self, rows):
+        texts = {}
+        postings = defaultdict(set)
+        for row_id, text in rows:
+            text = normalize(text)
+            texts[row_id] = text
+            for gram in trigrams(text):
+                postings[gram].add(row_id)
+
+        with self._lock:
+            self._texts = texts
+            self._postings = postings
+            self.loaded(None)
+
+    def load(self):
+        column = getattr(self.model, self.field)
+        result = db.session.execute(
+            db.select(self.model.id, column).execution_options(yield_per=10000))
+        self.build(result)
+
+    def add(self, row_id, text):
+        text = normalize(text)
+        with self._lock:
+            self.remove(row_id)
+            self._texts[row_id] = text
+            for gram in trigrams(text):
+                self._postings[gram].add(row_id)
+
+    def remove(self, row_id):
+        with self._lock:
+            text = self._texts.pop(row_id, None)
+            if text is None:
+                return
+            for gram in trigrams(text):
+                ids = self._postings.get(gram)
+                if ids is not None:
+                    ids.discard(row_id)
+                    if not ids:
+                        del self._postings[gram]
+
+    def apply(self, changes):
+        for old, new in changes:
+            if new is None:
+                self.remove(old['id'])
+            else:
+                self.add(new['id'], new[self.field])
+
+    '''
+    search(query, limit)
+        returns the ids of the best matches, best first
+            1. the whole text is the query
+            2. the text starts with the query
+            3. a word starts with the query
+            4. the query is somewhere in the text
+        shorter texts first within the same rank
+        a query shorter than a trigram can be inside any word, all the texts
+        are checked then (like the LIKE of the database backend)
+    '''
+    def search(self, query, limit=10):
+        query = normalize(query)
+        if not query:
+            return []
+        if len(query) < 3:
+            with self._lock:
+                return self._rank(self._texts, query, limit)
+
+        grams = query_trigrams(query)
+        with self._lock:
+            # Intersects the smallest posting lists first
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for ids in postings[1:]:
+                candidates &= ids
+                if not candidates:
+                    return []
+            return self._rank(candidates, query, limit)
+
+    def _rank(self, row_ids, query, limit):
+        matches = []
+        for row_id in row_ids:
+            text = self._texts[row_id]
+            rank = match_rank(text, query)
+            if rank is not None:
+                matches.append((rank, len(text), row_id))
+        return [row_id for _, _, row_id in heapq.nsmallest(limit, matches)]
+
+
+def match_rank(text, query):
+    if text == query:
+        return 0
+    if text.startswith(query):
+        return 1
+    if f' {query}' in f' {text}':
+        return 2
+    if query in text:
+        return 3
+    return None
+
+
+search_indexes = {
+    'actors': SearchIndex(Actor, 'name'),
+    'movies': SearchIndex(Movie, 'title')
+}
+
+@on_change
+def update_search_index(tablename, changes):
+    index = search_indexes.get(tablename)
+    if index is not None and index.built_at is not None:
+        index.apply(changes)
+
+
+'''
+build_search_indexes()
+    loads the in-memory indexes, must be called within an app context
+'''
+def build_search_indexes():
+    if SEARCH_BACKEND != 'memory':
+        return
+    for index in search_indexes.values():
+        index.load()
+
+
+'''
+search(model, query, limit, fields)
+    returns the best matching rows of the model (named tuples), best first
+    with only the fields (and the id) if given
+'''
+def search(model, query, limit=10, fields=None):
+    index = search_indexes[model.__tablename__]
+
+    if SEARCH_BACKEND == 'database':
+        return database_search(model, index.field, query, limit, fields)
+
+    index.refresh()
+    ids = index.search(query, limit)
+    if not ids:
+        return []
+
+    rows = {row.id: row for row in db.session.execute(
+        select_columns(model, fields).where(model.id.in_(ids)))}
+    # Rows deleted by another worker may still be in the index for a while
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
+
+def database_search(model, field, query, limit, fields=None):
+    column = func.lower(getattr(model, field))
+    query = query.casefold()
+    pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    ranking = [
+        (column == query).desc(),
+        column.startswith(query, autoescape=True).desc()
+    ]
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Uses the gin_trgm_ops indexes on lower(name) and lower(title)
+        ranking.append(func.similarity(column, literal(query)).desc())
+    ranking += [func.length(column), model.id]
+
+    return db.session.execute(
+        select_columns(model, fields).where(column.like(pattern, escape='\\'))
+        .order_by(*ranking).limit(limit)).all()
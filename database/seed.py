@@ -0,0 +1,228 @@
+import io
+import random
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select, text
+
+from database.models import Actor, Movie, cast, db
+
+'''
+Fake actors and movies in bulk, for load and capacity tests
+
+    flask seed --actors 1000000 --movies 1000000 --reset
+
+the same seed (and options) always gives the same rows, so the results of
+two runs can be compared, the rows are loaded with COPY on Postgres and
+with batched executemany INSERTs elsewhere, all in one transaction
+the rows don't go through the models, the search indexes and the count
+caches of running workers only see them after they are rebuilt
+'''
+
+FIRST_NAMES = ['Tom', 'Scarlett', 'Ryan', 'Emma', 'Denzel', 'Meryl', 'Keanu', 'Viola',
+               'Brad', 'Cate', 'Idris', 'Natalie', 'Will', 'Zendaya', 'Chris', 'Lupita']
+LAST_NAMES = ['Hanks', 'Johansson', 'Reynolds', 'Stone', 'Washington', 'Streep', 'Reeves',
+              'Davis', 'Pitt', 'Blanchett', 'Elba', 'Portman', 'Smith', 'Coleman', 'Evans']
+GENDERS = ['Male', 'Female']
+TITLE_WORDS = ['Lion', 'King', 'Night', 'Return', 'Dark', 'Star', 'Avengers', 'Lost', 'City',
+               'Dream', 'Empire', 'Storm', 'Last', 'Journey', 'Shadow', 'River', 'Iron', 'Game']
+
+FIRST_RELEASE = date(1950, 1, 1)
+RELEASE_DAYS = (date(2025, 12, 31) - FIRST_RELEASE).days
+
+# uniform: every age (or day) as likely as the others
+# normal: ages around 40, like most casts
+# recent: more movies every year, like the real catalogues
+AGE_DISTRIBUTIONS = ('uniform', 'normal')
+RELEASE_DISTRIBUTIONS = ('uniform', 'recent')
+
+
+'''
+picker(values, skew)
+    a function that takes a random value, with skew 0 they are all as
+    likely, with a higher skew the first values are more common (Zipf-like)
+    so some names are much more frequent than others, like in real data
+'''
+def picker(values, skew=0):
+    if not skew:
+        return lambda rng: rng.choice(values)
+
+    cum_weights = list(accumulate(1 / rank ** skew for rank in range(1, len(values) + 1)))
+    return lambda rng: rng.choices(values, cum_weights=cum_weights)[0]
+
+
+def fake_actors(count, rng, age_distribution='uniform', female_ratio=0.5, name_skew=0):
+    first_name = picker(FIRST_NAMES, name_skew)
+    last_name = picker(LAST_NAMES, name_skew)
+    # An even split keeps the rows of the earlier versions of the seeder
+    gender = picker(GENDERS) if female_ratio == 0.5 else \
+        lambda rng: rng.choices(GENDERS, weights=(1 - female_ratio, female_ratio))[0]
+
+    for _ in range(count):
+        name = f'{first_name(rng)} {last_name(rng)}'
+        if age_distribution == 'normal':
+            age = min(max(round(rng.gauss(40, 14)), 18), 90)
+        else:
+            age = rng.randint(18, 80)
+        yield {
+            'name': name,
+            'age': age,
+            'gender': gender(rng)
+        }
+
+
+def fake_movies(count, rng, release_distribution='uniform', name_skew=0):
+    weights = None
+    if name_skew:
+        weights = [1 / rank ** name_skew for rank in range(1, len(TITLE_WORDS) + 1)]
+
+    for _ in range(count):
+        words = rng.randint(1, 3)
+        if weights:
+            title = ' '.join(rng.choices(TITLE_WORDS, weights=weights, k=words))
+        else:
+            title = ' '.join(rng.sample(TITLE_WORDS, words))
+        if release_distribution == 'recent':
+            days = int(rng.triangular(0, RELEASE_DAYS, RELEASE_DAYS))
+        else:
+            days = rng.randint(0, RELEASE_DAYS)
+        yield {
+            'title': title,
+            'release_date': FIRST_RELEASE + timedelta(days=days)
+        }
+
+
+'''
+fake_cast(movie_ids, actor_ids, size, rng)
+    size random actors (or all of them if there are fewer) for each movie
+'''
+def fake_cast(movie_ids, actor_ids, size, rng):
+    size = min(size, len(actor_ids))
+    for movie_id in movie_ids:
+        for actor_id in sorted(rng.sample(actor_ids, size)):
+            yield {'movie_id': movie_id, 'actor_id': actor_id}
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def copy_statement(dialect, table, columns):
+    # Quoted like SQLAlchemy does, cast is a reserved word on Postgres
+    quote = dialect.identifier_preparer.quote
+    return f'COPY {quote(table.name)} ({", ".join(quote(column) for column in columns)}) FROM STDIN'
+
+
+def copy_rows(connection, table, rows):
+    columns = list(rows[0])
+    data = io.StringIO(''.join(
+        '\t'.join(copy_value(row[column]) for column in columns) + '\n' for row in rows))
+
+    # COPY is not part of SQLAlchemy, it goes through the psycopg2 cursor
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(copy_statement(connection.dialect, table, columns), data)
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, table, rows):
+    connection.execute(insert(table), rows)
+
+
+def clear_tables(connection):
+    tables = [cast, Movie.__table__, Actor.__table__]
+    if connection.dialect.name == 'postgresql':
+        quote = connection.dialect.identifier_preparer.quote
+        # Also restarts the ids, so the same seed gives the same ids
+        connection.execute(text(
+            f'TRUNCATE {", ".join(quote(table.name) for table in tables)} RESTART IDENTITY'))
+    else:
+        for table in tables:
+            connection.execute(delete(table))
+
+
+'''
+seed(engine, actors, movies, seed, batch_size, reset, cast_size, **distributions)
+    adds actors and movies fake rows in one transaction, reset deletes
+    the rows that were there before, cast_size is how many actors are
+    cast in each of the new movies
+    distributions are the options of fake_actors and fake_movies
+    returns {tablename: (rows, seconds)}
+'''
+def seed(engine, actors, movies, seed=0, batch_size=10000, reset=False, cast_size=0,
+         age_distribution='uniform', release_distribution='uniform',
+         female_ratio=0.5, name_skew=0):
+    rng = random.Random(seed)
+    load = copy_rows if engine.dialect.driver == 'psycopg2' else insert_rows
+    tables = (
+        (Actor, fake_actors(actors, rng, age_distribution, female_ratio, name_skew)),
+        (Movie, fake_movies(movies, rng, release_distribution, name_skew))
+    )
+
+    results = {}
+    with engine.begin() as connection:
+        if reset:
+            clear_tables(connection)
+        # The new movies are the ones after it, for their cast
+        last_movie_id = connection.scalar(select(func.max(Movie.id))) or 0
+
+        for model, rows in tables:
+            results[model.__tablename__] = load_rows(connection, load, model.__table__, rows, batch_size)
+
+        if cast_size:
+            movie_ids = connection.scalars(
+                select(Movie.id).where(Movie.id > last_movie_id).order_by(Movie.id)).all()
+            actor_ids = connection.scalars(select(Actor.id).order_by(Actor.id)).all()
+            results[cast.name] = load_rows(
+                connection, load, cast, fake_cast(movie_ids, actor_ids, cast_size, rng), batch_size)
+
+    return results
+
+
+def load_rows(connection, load, table, rows, batch_size):
+    start = time.perf_counter()
+    count = 0
+    for batch in batches(rows, batch_size):
+        load(connection, table, batch)
+        count += len(batch)
+    return count, time.perf_counter() - start
+
+
+@click.command('seed')
+@click.option('--actors', default=1000, help='How many actors to add.')
+@click.option('--movies', default=1000, help='How many movies to add.')
+@click.option('--seed', 'seed_value', default=0, help='The same seed gives the same rows.')
+@click.option('--batch-size', default=10000, help='Rows sent to the database at once.')
+@click.option('--reset', is_flag=True, help='Deletes the actors and movies first.')
+@click.option('--cast-size', default=0, help='How many actors play in each new movie.')
+@click.option('--age-distribution', type=click.Choice(AGE_DISTRIBUTIONS), default='uniform')
+@click.option('--release-distribution', type=click.Choice(RELEASE_DISTRIBUTIONS), default='uniform')
+@click.option('--female-ratio', type=click.FloatRange(0, 1), default=0.5)
+@click.option('--name-skew', type=click.FloatRange(0), default=0.0,
+              help='0 for names as likely as each other, higher for a few common ones.')
+@with_appcontext
+def seed_command(actors, movies, seed_value, batch_size, reset, cast_size, **distributions):
+    """Fills the actors and movies tables with fake rows."""
+    results = seed(db.engine, actors, movies, seed_value, batch_size, reset, cast_size,
+                   **distributions)
+
+    for tablename, (rows, seconds) in results.items():
+        rate = rows / seconds if seconds else 0
+        click.echo(f'{tablename:<8} {rows:>10} rows in {seconds:7.2f}s ({rate:,.0f} rows/s)')
@@ -0,0 +1,173 @@
+import os
+import time
+from collections import Counter, namedtuple
+from datetime import date
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import extract
+
+from database.models import Actor, Movie, db, on_change
+from database.reloading import Reloadable, bump_generation
+
+'''
+Aggregate statistics of the actors and movies (GET /actors/stats and
+GET /movies/stats)
+
+Each worker keeps the counts in memory: they are computed once with a
+GROUP BY per statistic, then adjusted from the rows of every commit (the
+change listeners), so reading them costs nothing whatever the size of the
+tables. They are rebuilt from the database every STATS_TTL seconds, and
+by every worker on its next read after flask rebuild-stats (which bumps
+their generation)
+'''
+
+# How often (in seconds) the statistics are rebuilt from the database
+STATS_TTL = int(os.environ.get('STATS_TTL', 300))
+# The width (in years) of the age groups
+STATS_AGE_GROUP = int(os.environ.get('STATS_AGE_GROUP', 10))
+
+
+'''
+Statistic
+    counts the rows by a key: expression is the key in SQL (for the
+    rebuilds), key(row) the same key of a row in its format() form (for
+    the changes)
+'''
+Statistic = namedtuple('Statistic', ['expression', 'key'])
+
+
+def age_group(row):
+    return int(row['age']) // STATS_AGE_GROUP * STATS_AGE_GROUP
+
+
+def release_year(row):
+    release_date = row['release_date']
+    # The ORM keeps the value as it was given until the row is loaded again
+    if not isinstance(release_date, date):
+        release_date = date.fromisoformat(str(release_date)[:10])
+    return release_date.year
+
+
+'''
+TableStats
+    the total and the statistics of a table
+'''
+class TableStats(Reloadable):
+    def __init__(self, model, statistics, ttl=STATS_TTL):
+        super().__init__(ttl)
+        self.model = model
+        self.statistics = statistics
+        self.name = f'{model.__tablename__} statistics'
+        self.generation_name = f'stats:{model.__tablename__}'
+        self._total = 0
+        self._counts = {}
+
+    def load(self):
+        # Read first, a rebuild asked for during the load is not missed
+        generation = self.current_generation()
+        total = db.session.scalar(db.select(db.func.count()).select_from(self.model))
+        counts = {}
+        for name, statistic in self.statistics.items():
+            counts[name] = Counter(dict(db.session.execute(
+                db.select(statistic.expression, db.func.count())
+                .group_by(statistic.expression)).all()))
+
+        with self._lock:
+            self._total = total
+            self._counts = counts
+            self.loaded(generation)
+
+    def apply(self, changes):
+        with self._lock:
+            if self.built_at is None:
+                return
+            try:
+                for old, new in changes:
+                    for row, step in ((old, -1), (new, 1)):
+                        if row is None:
+                            continue
+                        self._total += step
+                        for name, statistic in self.statistics.items():
+                            self._counts[name][statistic.key(row)] += step
+            except (KeyError, TypeError, ValueError):
+                # A value the keys can't read, the next read loads them again
+                self.built_at = None
+
+    '''
+    get()
+        the total and each statistic as {key: count}, in key order
+    '''
+    def get(self):
+        self.refresh()
+        with self._lock:
+            stats = {'total': self._total}
+            for name, counts in self._counts.items():
+                stats[name] = {key: count for key, count in sorted(counts.items()) if count > 0}
+        return stats
+
+
+table_stats = {
+    'actors': TableStats(Actor, {
+        'genders': Statistic(Actor.gender, lambda row: row['gender']),
+        'ages': Statistic(Actor.age // STATS_AGE_GROUP * STATS_AGE_GROUP, age_group)
+    }),
+    'movies': TableStats(Movie, {
+        'release_years': Statistic(
+            db.cast(extract('year', Movie.release_date), db.Integer), release_year)
+    })
+}
+
+@on_change
+def update_table_stats(tablename, changes):
+    stats = table_stats.get(tablename)
+    if stats is not None:
+        stats.apply(changes)
+
+
+'''
+actor_stats() and movie_stats()
+    the statistics of the endpoints, must be called within an app context
+'''
+def actor_stats():
+    stats = table_stats['actors'].get()
+    return {
+        'total_actors': stats['total'],
+        'genders': stats['genders'],
+        # i.e. {"30-39": 12}
+        'ages': {f'{start}-{start + STATS_AGE_GROUP - 1}': count
+                 for start, count in stats['ages'].items()}
+    }
+
+
+def movie_stats():
+    stats = table_stats['movies'].get()
+    return {
+        'total_movies': stats['total'],
+        # The keys of a JSON object are strings
+        'release_years': {str(year): count for year, count in stats['release_years'].items()}
+    }
+
+
+'''
+build_table_stats()
+    loads the statistics of every table, must be called within an app context
+'''
+def build_table_stats():
+    for stats in table_stats.values():
+        stats.load()
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Makes the workers count the statistics again and prints them."""
+    for stats in table_stats.values():
+        bump_generation(stats.generation_name)
+
+    start = time.perf_counter()
+    build_table_stats()
+    click.echo(f'Counted in {(time.perf_counter() - start) * 1000:.1f} ms')
+    for name, stats in (('actors', actor_stats()), ('movies', movie_stats())):
+        click.echo(f'{name}: {current_app.json.dumps(stats)}')
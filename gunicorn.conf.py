@@ -0,0 +1,22 @@
+import os
+
+'''
+Settings read by gunicorn when it is started from the root directory
+(gunicorn app:app), everything else is given on the command line
+
+With WARMUP=true each worker connects to the database, loads the search
+indexes and the statistics and fetches the signing keys before taking
+requests, instead of leaving that to its first requests
+'''
+
+WARMUP = os.environ.get('WARMUP', 'false') == 'true'
+
+
+def post_worker_init(worker):
+    if not WARMUP:
+        return
+
+    from app import warmup
+    timings = warmup(worker.wsgi)
+    print(f'Worker {worker.pid} warmed up in '
+          + ', '.join(f'{step} {seconds * 1000:.0f}ms' for step, seconds in timings.items()))
@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from database.pool import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from middleware.metrics import metrics, record_phase
+
+'''
+Admission control
+
+Each worker lets a limited number of requests run at once, the others
+wait in a bounded queue for up to ADMISSION_QUEUE_TIMEOUT seconds, and
+when the queue is full or the wait is over they are answered right away
+with 503 and a Retry-After header. So a spike of slow requests can't
+take every thread and every database connection.
+
+The reads (GET, HEAD) and the writes share a budget each, a route can be
+given its own in ADMISSION_ROUTE_LIMITS, as comma separated
+"<METHOD> <route>=<limit>" or "<METHOD> <route>=<limit>:<queue size>",
+i.e. "GET /actors/export=2:0,POST /actors/bulk=1"
+The routes of ADMISSION_EXEMPT (the health checks and metrics) are never
+limited.
+'''
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+# By default the reads can use every connection of the pool
+ADMISSION_READ_LIMIT = int(os.environ.get('ADMISSION_READ_LIMIT', DB_POOL_SIZE + DB_MAX_OVERFLOW))
+ADMISSION_WRITE_LIMIT = int(os.environ.get('ADMISSION_WRITE_LIMIT', 5))
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', 50))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+ADMISSION_ROUTE_LIMITS = os.environ.get('ADMISSION_ROUTE_LIMITS', '')
+ADMISSION_EXEMPT = os.environ.get('ADMISSION_EXEMPT', '/health,/health/pool,/metrics')
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+'''
+Budget
+    how many requests may run at once (limit) and wait for their turn
+    (queue_size, at most timeout seconds each)
+'''
+class Budget:
+    def __init__(self, name, limit, queue_size=ADMISSION_QUEUE_SIZE, timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    '''
+    acquire()
+        returns (admitted, seconds waited, why it was not admitted)
+    '''
+    def acquire(self):
+        start = time.monotonic()
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True, 0.0, None
+            if self.waiting >= self.queue_size:
+                return False, 0.0, 'queue_full'
+
+            self.waiting += 1
+            try:
+                deadline = start + self.timeout
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False, time.monotonic() - start, 'timeout'
+                    self._condition.wait(remaining)
+                self.active += 1
+                return True, time.monotonic() - start, None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+'''
+parse_route_limits(text)
+    the budgets of ADMISSION_ROUTE_LIMITS by (method, route)
+'''
+def parse_route_limits(text):
+    budgets = {}
+    for entry in text.split(','):
+        if not entry.strip():
+            continue
+        try:
+            route, value = entry.strip().rsplit('=', 1)
+            method, rule = route.split(None, 1)
+            limit, _, queue_size = value.partition(':')
+            budgets[(method.upper(), rule.strip())] = Budget(
+                f'{method.upper()} {rule.strip()}', int(limit),
+                int(queue_size) if queue_size else ADMISSION_QUEUE_SIZE)
+        except ValueError:
+            print(f'ERROR ==> Ignoring the invalid admission limit {entry!r}')
+    return budgets
+
+
+class AdmissionControl:
+    def __init__(self, read_limit=ADMISSION_READ_LIMIT, write_limit=ADMISSION_WRITE_LIMIT,
+                 route_limits=ADMISSION_ROUTE_LIMITS, exempt=ADMISSION_EXEMPT):
+        self.reads = Budget('read', read_limit)
+        self.writes = Budget('write', write_limit)
+        self.routes = parse_route_limits(route_limits)
+        self.exempt = {rule.strip() for rule in exempt.split(',') if rule.strip()}
+
+    def budget_for(self, method, rule):
+        if rule is None or rule in self.exempt or method == 'OPTIONS':
+            return None
+        budget = self.routes.get((method, rule))
+        if budget is not None:
+            return budget
+        return self.reads if method in READ_METHODS else self.writes
+
+    def budgets(self):
+        return [self.reads, self.writes] + list(self.routes.values())
+
+
+metrics.describe('http_requests_shed_total', 'counter',
+                 'Requests answered with 503 by the admission control, by route, method, '
+                 'budget and reason (queue_full or timeout).')
+
+
+'''
+init_admission(app)
+    limits the requests of the app, the AdmissionControl is kept in
+    app.extensions['admission']
+'''
+def init_admission(app, admission=None):
+    if not ADMISSION_ENABLED:
+        return
+
+    admission = admission or AdmissionControl()
+    app.extensions['admission'] = admission
+
+    metrics.gauge('admission_in_flight', 'Requests running, by admission budget.',
+                  lambda: [((('budget', budget.name),), budget.active)
+                           for budget in admission.budgets()])
+    metrics.gauge('admission_queued', 'Requests waiting for their turn, by admission budget.',
+                  lambda: [((('budget', budget.name),), budget.waiting)
+                           for budget in admission.budgets()])
+
+    @app.before_request
+    def admit_request():
+        rule = request.url_rule.rule if request.url_rule else None
+        budget = admission.budget_for(request.method, rule)
+        if budget is None:
+            return None
+
+        admitted, waited, reason = budget.acquire()
+        record_phase('queue', waited)
+        if admitted:
+            g.admission_budget = budget
+            return None
+
+        metrics.inc('http_requests_shed_total', (
+            ('route', rule), ('method', request.method),
+            ('budget', budget.name), ('reason', reason)))
+        response = jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'service unavailable, retry later'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+        return response
+
+    @app.teardown_request
+    def release_request(error=None):
+        budget = g.pop('admission_budget', None)
+        if budget is not None:
+            budget.release()
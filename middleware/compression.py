@@ -0,0 +1,144 @@
+import gzip
+import os
+import zlib
+
+from flask import request
+
+from middleware.metrics import metrics, timed
+from middleware.response_cache import response_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Response compression
+
+The JSON (and NDJSON) responses are compressed with brotli (when the
+brotli package is installed) or gzip, whichever the client prefers in its
+Accept-Encoding header
+    - bodies under COMPRESSION_MIN_SIZE bytes are sent as they are, the
+      headers would be most of the response anyway
+    - streamed responses (the exports) are compressed chunk by chunk, each
+      chunk is flushed so the client gets the rows as they are read
+    - the responses of the response cache are only compressed once, the
+      compressed body is cached next to them under their ETag
+the ETag of a compressed response is weak (W/"..."), the bodies are not
+the same bytes but the same content
+'''
+
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# gzip: 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# brotli: 0 (fastest) to 11 (smallest), past 5 it gets slow for dynamic responses
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+COMPRESSION_MIMETYPES = os.environ.get(
+    'COMPRESSION_MIMETYPES', 'application/json,application/x-ndjson,text/plain')
+
+# The preferred one first, when the client accepts both as much
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+'''
+choose_encoding(accept_encodings)
+    the encoding to compress with, None if the client accepts none of them
+'''
+def choose_encoding(accept_encodings):
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        # Also takes * into account, and q=0 that refuses an encoding
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, COMPRESSION_LEVEL, mtime=0)
+
+
+'''
+compress_stream(chunks, encoding)
+    compresses the chunks of a streamed response as they come
+'''
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        # wbits 31: the gzip header and trailer
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if chunk:
+                yield process(chunk) + flush()
+        yield finish()
+    finally:
+        # Closes the stream (and its database cursor) if the client went away
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+metrics.describe('http_response_bytes_total', 'counter',
+                 'Bytes of the compressed responses before (identity) and after compression, '
+                 'by encoding, streamed responses are not counted.')
+
+
+'''
+init_compression(app)
+    compresses the responses of the app, to be called after init_metrics
+    so the time spent compressing is part of the request time
+'''
+def init_compression(app):
+    if not COMPRESSION_ENABLED:
+        return
+
+    mimetypes = {mimetype.strip() for mimetype in COMPRESSION_MIMETYPES.split(',')}
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in mimetypes:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if not 200 <= response.status_code < 300 or response.status_code in (204, 206) \
+                or response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+
+        etag, weak = response.get_etag()
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < COMPRESSION_MIN_SIZE:
+                return response
+
+            with timed('compress'):
+                if etag and not weak:
+                    compressed = response_cache.variant(
+                        etag, encoding, lambda: compress(body, encoding))
+                else:
+                    compressed = compress(body, encoding)
+            metrics.inc('http_response_bytes_total', (('encoding', 'identity'),), len(body))
+            metrics.inc('http_response_bytes_total', (('encoding', encoding),), len(compressed))
+            response.set_data(compressed)
+
+        if etag and not weak:
+            # Not the same bytes anymore, only the same content
+            response.set_etag(etag, weak=True)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,97 @@
+import dataclasses
+import decimal
+import json
+import os
+import uuid
+from datetime import date
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson: the orjson package (written in Rust), needs it to be installed
+# stdlib: Python's json module
+# auto: orjson if it is installed, else stdlib (the default)
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+
+# Many rows share the same dates, formatting one is slower than looking it up
+@lru_cache(maxsize=4096)
+def format_date(value):
+    return http_date(value)
+
+
+'''
+json_default(value)
+    the types json and orjson can't write, the same output as Flask's
+    jsonify (dates as HTTP dates), records and rows are written as objects
+'''
+def json_default(value):
+    if isinstance(value, date):
+        return format_date(value)
+    if dataclasses.is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    if hasattr(value, '_asdict'):
+        # SQLAlchemy rows (named tuples never get here, json writes them as lists)
+        return value._asdict()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    default = staticmethod(json_default)
+
+
+'''
+OrjsonProvider
+    the same output as the default provider (sorted keys, HTTP dates)
+    orjson writes dicts, lists and records (dataclasses) on its own,
+    only dates go back to Python through json_default
+'''
+class OrjsonProvider(DefaultJSONProvider):
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+               | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps_bytes(self, obj, indent=None):
+        options = self.options | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=json_default, option=options)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, kwargs.get('indent')).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def json_provider(app):
+    if JSON_BACKEND == 'orjson' or (JSON_BACKEND == 'auto' and orjson is not None):
+        if orjson is None:
+            print('ERROR ==> JSON_BACKEND is orjson but orjson is not installed, using json')
+        else:
+            return OrjsonProvider(app)
+    return StdlibJSONProvider(app)
+
+
+'''
+dumps(obj)
+    the JSON of obj as bytes, for the responses built outside of Flask (asgi.py)
+'''
+def dumps(obj):
+    if orjson is not None and JSON_BACKEND != 'stdlib':
+        return orjson.dumps(obj, default=json_default, option=OrjsonProvider.options)
+    return json.dumps(obj, default=json_default, ensure_ascii=True, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
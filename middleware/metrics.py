@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+
+from database.instrumentation import request_stats
+
+# Turns the request metrics off (the /metrics endpoint is then empty)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+'''
+MetricsRegistry
+    counters and histograms kept in the Prometheus text format
+
+    every thread records into its own shard so recording a value never
+    takes a lock, the shards are only merged when /metrics is scraped
+    (the shards of finished threads are folded into one, so servers that
+    start a thread per request don't pile them up)
+'''
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._help = {}
+        self._gauges = {}
+        self._shards = []
+        self._retired = ({}, {})
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    '''
+    gauge(name, help_text, read)
+        read is called on every scrape and returns the value
+        or a list of (labels, value)
+    '''
+    def gauge(self, name, help_text, read):
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = read
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = ({}, {})
+            # Only the first value recorded by a thread takes the lock
+            with self._lock:
+                self._retire_finished_threads()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    # Must be called with the lock held
+    def _retire_finished_threads(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                merge(self._retired, shard)
+        self._shards = alive
+
+    # labels is a tuple of (name, value) pairs
+    def inc(self, name, labels=(), amount=1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        series = histograms.get(key)
+        if series is None:
+            # One count per bucket, the +Inf bucket and the sum
+            series = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        total = ({}, {})
+        with self._lock:
+            self._retire_finished_threads()
+            merge(total, self._retired)
+            shards = [shard for _, shard in self._shards]
+
+        for shard in shards:
+            merge(total, shard)
+
+        return total
+
+    def clear(self):
+        with self._lock:
+            for counters, histograms in [self._retired] + [shard for _, shard in self._shards]:
+                counters.clear()
+                histograms.clear()
+
+    def render(self):
+        counters, histograms = self.collect()
+        families = {}
+
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append(
+                f'{name}{format_labels(labels)} {format_value(value)}')
+
+        for (name, labels), series in histograms.items():
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                bucket_labels = labels + (('le', format_value(bound)),)
+                lines.append(f'{name}_bucket{format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(series[-1])}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+
+        for name, read in self._gauges.items():
+            try:
+                values = read()
+            except Exception as e:
+                print(f'ERROR ==> Unable to read the {name} metric: {e}')
+                continue
+            if not isinstance(values, list):
+                values = [((), values)]
+            families[name] = [f'{name}{format_labels(labels)} {format_value(value)}'
+                              for labels, value in values]
+
+        output = []
+        for name in sorted(families):
+            kind, help_text = self._help.get(name, ('untyped', ''))
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} {kind}')
+            output.extend(sorted(families[name]))
+
+        return '\n'.join(output) + '\n'
+
+
+def merge(total, shard):
+    counters, histograms = total
+    shard_counters, shard_histograms = shard
+    # The shard's thread may be adding series meanwhile, hence the copies
+    for key, value in list(shard_counters.items()):
+        counters[key] = counters.get(key, 0) + value
+    for key, series in list(shard_histograms.items()):
+        merged = histograms.setdefault(key, [0] * len(series))
+        for i, value in enumerate(list(series)):
+            merged[i] += value
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+metrics = MetricsRegistry()
+metrics.describe('http_requests_total', 'counter',
+                 'Requests handled, by route, method and status code.')
+metrics.describe('http_request_errors_total', 'counter',
+                 'Requests answered with a 4xx or 5xx status, by route, method and status code.')
+metrics.describe('http_request_phase_seconds', 'histogram',
+                 'Time spent in each phase of a request (queue, auth_header, auth_key_lookup, '
+                 'auth_decode, auth, db, serialize, compress, total), by route and method.')
+
+
+'''
+record_phase(phase, seconds)
+    adds time to a phase of the current request
+    does nothing outside of a Flask request (i.e. in asgi.py)
+'''
+def record_phase(phase, seconds):
+    if not METRICS_ENABLED or not has_app_context():
+        return
+    phases = g.get('metric_phases')
+    if phases is None:
+        phases = g.metric_phases = {}
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+'''
+init_metrics(app)
+    measures every request of the app, to be called once the app's
+    JSON provider is set since jsonify is timed through it
+'''
+def init_metrics(app):
+    if not METRICS_ENABLED:
+        return
+
+    provider = app.json
+    response = provider.response
+
+    def timed_response(*args, **kwargs):
+        with timed('serialize'):
+            return response(*args, **kwargs)
+
+    provider.response = timed_response
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+
+        phases = g.get('metric_phases', {})
+        phases['total'] = time.perf_counter() - start
+        phases['db'] = request_stats().db_time
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('route', route), ('method', request.method))
+        for phase, seconds in phases.items():
+            metrics.observe('http_request_phase_seconds', labels + (('phase', phase),), seconds)
+
+        status = labels + (('status', str(response.status_code)),)
+        metrics.inc('http_requests_total', status)
+        if response.status_code >= 400:
+            metrics.inc('http_request_errors_total', status)
+
+        return response
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import make_response, request
+
+from database.models import db, on_change
+from database.routing import use_primary
+
+# memory: each worker has its own cache, a change made through another
+#   worker is only seen once the cached responses expire (RESPONSE_CACHE_TTL)
+# redis: the workers share the cache and its invalidations (needs the redis package)
+# none: turns the cache off
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+# Short for the memory cache, it is how long the other workers may answer
+# with the responses from before a change
+RESPONSE_CACHE_TTL = int(os.environ.get(
+    'RESPONSE_CACHE_TTL', 300 if RESPONSE_CACHE_BACKEND == 'redis' else 5))
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'mimetype'])
+
+
+'''
+CacheBackend
+    where the cached responses and the version of each namespace are kept
+    bumping the version of a namespace invalidates all of its responses
+'''
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def get_version(self, namespace):
+        raise NotImplementedError
+
+    def bump_version(self, namespace):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+
+class RedisBackend(CacheBackend):
+    def __init__(self, url=RESPONSE_CACHE_URL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        entry = self.client.hgetall(key)
+        if not entry:
+            return None
+        return CachedResponse(
+            entry[b'body'], entry[b'etag'].decode(), entry[b'mimetype'].decode())
+
+    def set(self, key, value, ttl):
+        pipeline = self.client.pipeline()
+        pipeline.hset(key, mapping=value._asdict())
+        pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def get_version(self, namespace):
+        return int(self.client.get(f'version:{namespace}') or 0)
+
+    def bump_version(self, namespace):
+        self.client.incr(f'version:{namespace}')
+
+
+'''
+ResponseCache
+    caches the JSON responses of GET endpoints per path, query string and
+    permissions of the caller, sends an ETag with them and answers
+    If-None-Match requests with 304 Not Modified
+'''
+class ResponseCache:
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    # namespaces are the tables the response is read from, a change to
+    # any of them makes the cached responses stale, embedded are the tables
+    # only read by the responses with ?embed= (i.e. the casts of a page)
+    def cached(self, *namespaces, embedded=()):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(jwt, *args, **kwargs):
+                if self.backend is None:
+                    return f(jwt, *args, **kwargs)
+
+                key = self.key(namespaces + (embedded if 'embed' in request.args else ()), jwt)
+                entry = self.backend.get(key)
+                if entry is None:
+                    # Right after a change a replica may not have it yet, its
+                    # body would be cached under the new version
+                    use_primary(db.session)
+                    response = make_response(f(jwt, *args, **kwargs))
+                    # Only complete successful responses are cached
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    entry = self.store(key, response)
+
+                return self.respond(entry)
+            return wrapper
+        return cached_decorator
+
+    def key(self, namespaces, jwt):
+        versions = ':'.join(f'{namespace}:{self.backend.get_version(namespace)}'
+                            for namespace in namespaces)
+        query = '&'.join(sorted(f'{k}={v}' for k, v in request.args.items(multi=True)))
+        scope = ','.join(sorted(jwt.get('permissions', [])))
+        return f'response:{versions}:{request.path}?{query}:{scope}'
+
+    def store(self, key, response):
+        body = response.get_data()
+        entry = CachedResponse(body, hashlib.sha1(body).hexdigest(), response.mimetype)
+        self.backend.set(key, entry, self.ttl)
+        return entry
+
+    def respond(self, entry):
+        # Weak comparison, the compressed responses have a weak ETag
+        weak = False
+        if request.if_none_match.contains_weak(entry.etag):
+            response = make_response('', 304)
+            # The same ETag as the body the client has, weak if it was compressed
+            weak = request.if_none_match.is_weak(entry.etag)
+        else:
+            response = make_response(entry.body)
+            response.mimetype = entry.mimetype
+
+        response.set_etag(entry.etag, weak=weak)
+        # The client may keep the response but has to check the ETag every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    '''
+    variant(etag, name, build)
+        another form of the body with this ETag (i.e. compressed), made by
+        build() the first time and cached with the responses after that
+        the ETag is a hash of the body, so the variant never gets stale
+    '''
+    def variant(self, etag, name, build):
+        if self.backend is None:
+            return build()
+
+        key = f'variant:{name}:{etag}'
+        entry = self.backend.get(key)
+        if entry is None:
+            entry = CachedResponse(build(), etag, name)
+            self.backend.set(key, entry, self.ttl)
+        return entry.body
+
+    def invalidate(self, namespace):
+        if self.backend is not None:
+            self.backend.bump_version(namespace)
+
+
+def create_backend(name):
+    if name == 'none':
+        return None
+    if name == 'redis':
+        return RedisBackend()
+    return MemoryBackend()
+
+
+response_cache = ResponseCache(create_backend(RESPONSE_CACHE_BACKEND))
+
+@on_change
+def invalidate_responses(tablename, changes):
+    response_cache.invalidate(tablename)
@@ -0,0 +1,36 @@
+"""add trigram indexes for searching actor names and movie titles
+
+Revision ID: 9d4c2f81e6ab
+Revises: 5b1e0a7d93c2
+Create Date: 2026-10-18 11:03:27.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4c2f81e6ab'
+down_revision = '5b1e0a7d93c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm is only available on Postgres, other databases search in memory
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_actors_name_trgm', 'actors', [sa.text('lower(name) gin_trgm_ops')],
+                    unique=False, postgresql_using='gin')
+    op.create_index('ix_movies_title_trgm', 'movies', [sa.text('lower(title) gin_trgm_ops')],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
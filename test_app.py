@@ -1,12 +1,44 @@
+import gzip
 import json
 import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
 import unittest
+from datetime import date
 
+from Crypto.PublicKey import RSA
 from dotenv import load_dotenv
+from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from jose import jwt
+from jose.utils import base64url_encode
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects import postgresql
 
-from app import create_app
-from database.models import Actor, Movie, db, db_drop_and_create_all
+from starlette.testclient import TestClient
+
+from app import actor_filters, create_app, movie_filters
+from asgi import create_asgi_app
+import auth.auth as auth
+from auth.auth import parse_algorithms
+from auth.jwks import JWKSKeyStore
+from auth.token_cache import TokenCache
+from database.instrumentation import RequestStats, fingerprint
+from database.models import Actor, Movie, cast, db, db_drop_and_create_all
+from database.reloading import bump_generation, get_generation
+from database.routing import replicas
+from database.search import database_search, search, search_indexes
+from database.seed import copy_statement, fake_actors, fake_movies
+from database.stats import actor_stats, build_table_stats, movie_stats
+from middleware.admission import AdmissionControl, Budget, init_admission
+from middleware.compression import choose_encoding, init_compression
+from middleware.json_provider import OrjsonProvider, StdlibJSONProvider, orjson
+from middleware.response_cache import response_cache
 
 load_dotenv()
 
@@ -70,6 +102,32 @@ class CapstoneTestCase(unittest.TestCase):
             self.db.session.commit()
 
 
+    # Test the "/health/pool" endpoint
+    def test_health_pool(self):
+        res = self.client().get('/health/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['pool']['pool'], 'MeteredQueuePool')
+        self.assertIn('checked_out', data['pool'])
+        self.assertIn('p99_wait_ms', data['pool']['wait'])
+
+    # Test the "/metrics" endpoint
+    def test_metrics(self):
+        self.client().get('/actors', headers=self.producer_token)
+        res = self.client().get('/metrics')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('text/plain', res.content_type)
+        self.assertIn('http_requests_total{route="/actors",method="GET",status="200"}', body)
+        for phase in ('auth', 'db', 'serialize', 'total'):
+            self.assertIn(
+                f'http_request_phase_seconds_count{{route="/actors",method="GET",phase="{phase}"}}',
+                body)
+
+
     """
     NOTE
     All tests are with the Executive Producer role token (all permissions)
@@ -89,6 +147,81 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertTrue(data['current_page'])
     
     # Test for possible error
+    # Test the "/actors/stats" and "/movies/stats" endpoints
+    def test_get_actor_stats(self):
+        # The tables were recreated by setUp, outside of the change listeners
+        with self.app.app_context():
+            build_table_stats()
+        res = self.client().get('/actors/stats', headers=self.assistant_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_actors'], 16)
+        self.assertEqual(data['genders'], {'Female': 8, 'Male': 8})
+        self.assertEqual(data['ages']['30-39'], 5)
+
+    def test_actor_stats_reload_when_the_generation_changes(self):
+        with self.app.app_context():
+            build_table_stats()
+            # Added without the change listeners, like another process would
+            db.session.execute(Actor.__table__.insert().values(name='Zoe Kravitz', age=34, gender='Female'))
+            db.session.commit()
+            self.assertEqual(actor_stats()['total_actors'], 16)
+
+            # What flask rebuild-stats does for the workers
+            bump_generation('stats:actors')
+            self.assertEqual(actor_stats()['total_actors'], 17)
+
+    def test_rebuild_stats_command_without_a_response_cache(self):
+        backend = response_cache.backend
+        response_cache.backend = None
+        try:
+            result = self.app.test_cli_runner().invoke(args=['rebuild-stats'])
+        finally:
+            response_cache.backend = backend
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('"total_actors":16', result.output.replace(' ', ''))
+        with self.app.app_context():
+            # The generation the other workers compare theirs with
+            self.assertEqual(get_generation('stats:actors'), 1)
+            self.assertEqual(get_generation('stats:movies'), 1)
+
+    def test_movie_stats_follow_changes(self):
+        with self.app.app_context():
+            build_table_stats()
+        self.client().post('/movies', headers=self.producer_token, json=self.valid_new_movie)
+        self.client().patch('/movies/1', headers=self.producer_token, json={'release_date': '1997-01-01'})
+        self.client().delete('/movies/2', headers=self.producer_token)
+        res = self.client().get('/movies/stats', headers=self.assistant_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_movies'], 16)
+        self.assertEqual(data['release_years']['1997'], 2)
+        self.assertEqual(data['release_years']['1994'], 3)
+        self.assertNotIn('2010', data['release_years'])
+        # The same as counted again from the table
+        with self.app.app_context():
+            build_table_stats()
+            self.assertEqual(dict(movie_stats(), success=True), data)
+
+    def test_get_actors_with_fields(self):
+        res = self.client().get('/actors?fields=name&sort=-age', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 10)
+        self.assertTrue(all(sorted(actor) == ['id', 'name'] for actor in data['actors']))
+        self.assertEqual(data['total_actors'], 16)
+
+    def test_400_get_actors_with_unknown_field(self):
+        res = self.client().get('/actors?fields=name,salary', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_404_error_paginating_actors_page_beyond_available(self):
         res = self.client().get('/actors?page=10000', headers=self.producer_token)
         data = json.loads(res.data)
@@ -98,6 +231,70 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'resource not found')
 
 
+    # Test the "/actors" endpoint with a cursor instead of a page number
+    def test_get_actors_after_cursor(self):
+        res = self.client().get('/actors?after=3&limit=5', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        # Make sure the page starts right after the cursor
+        self.assertEqual(len(data['actors']), 5)
+        self.assertEqual(data['actors'][0]['id'], 4)
+        self.assertEqual(data['next_cursor'], 8)
+
+    def test_400_paginating_actors_with_invalid_limit(self):
+        res = self.client().get('/actors?limit=0', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+
+    # Test the cached "/actors" responses
+    def test_304_get_actors_with_matching_etag(self):
+        res = self.client().get('/actors', headers=self.producer_token)
+        etag = res.headers['ETag']
+
+        res = self.client().get('/actors', headers=dict(self.producer_token, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_get_actors_gzip(self):
+        headers = dict(self.producer_token, **{'Accept-Encoding': 'gzip'})
+        res = self.client().get('/actors?limit=50&embed=movies', headers=headers)
+        data = json.loads(gzip.decompress(res.data))
+        etag = res.headers['ETag']
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(len(data['actors']), 16)
+        self.assertTrue(etag.startswith('W/'))
+
+        res = self.client().get('/actors?limit=50&embed=movies', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+        # Under COMPRESSION_MIN_SIZE, the body and its ETag are left as they are
+        res = self.client().get('/actors?limit=1', headers=headers)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertFalse(res.headers['ETag'].startswith('W/'))
+
+    def test_get_actors_cache_is_invalidated_on_insert(self):
+        res = self.client().get('/actors', headers=self.producer_token)
+        etag = res.headers['ETag']
+
+        self.client().post('/actors', headers=self.producer_token, json=self.valid_new_actor)
+        res = self.client().get('/actors', headers=dict(self.producer_token, **{'If-None-Match': etag}))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(data['total_actors'], 17)
+
+
     # Test the "/movies" endpoint to handle GET requests
     def test_get_paginated_movies(self):
         res = self.client().get('/movies', headers=self.producer_token)
@@ -120,6 +317,136 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'resource not found')
 
     
+    # Test the "/actors/export" and "/movies/export" endpoints
+    def test_export_actors(self):
+        res = self.client().get('/actors/export', headers=self.producer_token)
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        # One actor per line in id order
+        self.assertEqual(len(lines), 16)
+        self.assertEqual(json.loads(lines[0])['id'], 1)
+
+    def test_export_movies(self):
+        res = self.client().get('/movies/export', headers=self.assistant_token)
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(lines), 16)
+        self.assertEqual(json.loads(lines[-1])['title'], 'The Avengers')
+
+    
+    # Test the filters and sorting of "/actors" and "/movies"
+    def test_get_filtered_actors(self):
+        res = self.client().get('/actors?gender=Female&min_age=35&max_age=50&sort=-age', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        ages = [actor['age'] for actor in data['actors']]
+        # Only the matching actors, oldest first
+        self.assertEqual(ages, [46, 40, 37, 36])
+        self.assertEqual(data['total_actors'], 4)
+
+    def test_get_filtered_movies(self):
+        res = self.client().get('/movies?released_after=1994-01-01&released_before=1994-12-31&sort=title', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        titles = [movie['title'] for movie in data['movies']]
+        self.assertEqual(titles, ['Forrest Gump', 'Pulp Fiction', 'The Lion King', 'The Shawshank Redemption'])
+
+    def test_400_sorting_actors_by_unknown_column(self):
+        res = self.client().get('/actors?sort=salary', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Make sure every filter is answered from an index and not a sequential scan
+    def test_filters_use_indexes(self):
+        cases = [
+            (Actor, actor_filters, '/actors?gender=Male'),
+            (Actor, actor_filters, '/actors?min_age=30&max_age=40'),
+            (Actor, actor_filters, '/actors?gender=Female&min_age=30'),
+            (Movie, movie_filters, '/movies?released_after=1990-01-01&released_before=1999-12-31')
+        ]
+
+        with self.app.app_context():
+            connection = self.db.session.connection()
+            # Without this the planner prefers a sequential scan on tiny tables
+            connection.exec_driver_sql('SET enable_seqscan = off')
+
+            for model, filters, url in cases:
+                with self.app.test_request_context(url):
+                    statement = select(model.id).where(*filters(request))
+                compiled = statement.compile(dialect=connection.dialect)
+                plan = '\n'.join(row[0] for row in connection.exec_driver_sql(
+                    'EXPLAIN ' + str(compiled), compiled.params))
+
+                self.assertNotIn('Seq Scan', plan, url)
+                self.assertIn(f'ix_{model.__tablename__}_', plan, url)
+
+    
+    # Test the "/movies/search" and "/actors/search" endpoints
+    def test_search_movies(self):
+        res = self.client().get('/movies/search?q=the', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        # Titles starting with the query come before titles containing it
+        self.assertTrue(data['movies'][0]['title'].startswith('The'))
+        self.assertEqual(data['movies'][-1]['title'], 'E.T. the Extra-Terrestrial')
+
+    def test_search_actors_by_substring(self):
+        res = self.client().get('/actors/search?q=hans', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Scarlett Johansson'])
+
+    def test_search_backends_find_the_same_rows(self):
+        self.client().post('/actors', headers=self.producer_token,
+                           json={'name': 'Frank Reed', 'age': 50, 'gender': 'Male'})
+
+        with self.app.app_context():
+            search_indexes['actors'].load()
+            for query in ('k re', 'a wa', 'hans', 'tom h', 'jennifer'):
+                in_memory = {actor.id for actor in search(Actor, query, 100)}
+                in_database = {actor.id for actor in database_search(Actor, 'name', query, 100)}
+                self.assertTrue(in_memory, query)
+                self.assertEqual(in_memory, in_database, query)
+
+    def test_search_backends_agree_on_queries_shorter_than_a_trigram(self):
+        with self.app.app_context():
+            search_indexes['actors'].load()
+            # Inside the words (Johansson, Washington, Portman...), not only at their start
+            for query in ('on', 'ee', 'y'):
+                in_memory = [actor.id for actor in search(Actor, query, 100)]
+                in_database = [actor.id for actor in database_search(Actor, 'name', query, 100)]
+                self.assertTrue(in_memory, query)
+                self.assertEqual(set(in_memory), set(in_database), query)
+
+    def test_search_finds_added_movie(self):
+        self.client().post('/movies', headers=self.producer_token, json=self.valid_new_movie)
+        res = self.client().get('/movies/search?q=tita', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['movies'][0]['title'], 'Titanic')
+
+    def test_400_search_without_query(self):
+        res = self.client().get('/movies/search', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    
     # Test for the "/actors" DELETE endpoint and for a possible error
     def test_delete_actor(self):
         actor_id = 2
@@ -169,6 +496,31 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def test_deleting_actors_in_bulk(self):
+        res = self.client().delete('/actors?ids=3,4,1000', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], [3, 4])
+        self.assertEqual(data['errors'], [{'id': 1000, 'message': 'resource not found'}])
+        with self.app.app_context():
+            self.assertEqual(Actor.query.filter(Actor.id.in_([3, 4])).count(), 0)
+
+    def test_400_deleting_movies_in_bulk_without_ids(self):
+        res = self.client().delete('/movies?ids=one,two', headers=self.producer_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_403_deleting_movies_in_bulk_as_director(self):
+        res = self.client().delete('/movies?ids=1,2', headers=self.director_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+
 
     # Test for the "/actors" POST endpoint and for a possible error
     def test_adding_actor(self):
@@ -180,6 +532,25 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertTrue(data['added'])
         self.assertTrue(data['total_actors'])
 
+    def test_adding_actor_with_cached_count(self):
+        res = self.client().get('/actors?count=cached', headers=self.producer_token)
+        total_before = json.loads(res.data)['total_actors']
+
+        res = self.client().post('/actors?count=cached', headers=self.producer_token, json=self.valid_new_actor)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        # The counter is updated by the commit, not recounted
+        self.assertEqual(data['total_actors'], total_before + 1)
+
+    def test_400_adding_actor_with_invalid_count_mode(self):
+        res = self.client().post('/actors?count=guess', headers=self.producer_token, json=self.valid_new_actor)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_405_adding_actor_with_invalid_request(self):
         res = self.client().post('/actors', headers=self.producer_token, json=self.invalid_new_actor)
         data = json.loads(res.data)
@@ -189,6 +560,28 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'bad request')
 
 
+    # Test for the "/actors/bulk" POST endpoint and for a possible error
+    def test_adding_actors_in_bulk(self):
+        actors = [self.valid_new_actor, self.invalid_new_actor, self.valid_new_actor]
+        res = self.client().post('/actors/bulk', headers=self.producer_token, json=actors)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        # The valid actors are added and the invalid one is reported
+        self.assertEqual(len(data['added']), 2)
+        self.assertEqual(data['errors'][0]['index'], 1)
+        self.assertTrue(data['total_actors'])
+
+    def test_400_adding_actors_in_bulk_without_a_list(self):
+        res = self.client().post('/actors/bulk', headers=self.producer_token, json=self.valid_new_actor)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+
     # Test for the "/movies" POST endpoint and for a possible error
     def test_adding_movie(self):
         res = self.client().post('/movies', headers=self.producer_token, json=self.valid_new_movie)
@@ -208,6 +601,23 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'bad request')
 
     
+    # Test for the "/movies/bulk" POST endpoint
+    def test_adding_movies_in_bulk(self):
+        res = self.client().post('/movies/bulk', headers=self.producer_token, json={'movies': [self.valid_new_movie] * 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['added']), 3)
+        self.assertEqual(data['errors'], [])
+
+    def test_403_adding_movies_in_bulk_as_director(self):
+        res = self.client().post('/movies/bulk', headers=self.director_token, json=[self.valid_new_movie])
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+
+    
     # Test for the "/actors" PATCH endpoint and for a possible error
     def test_editing_actor(self):
         actor_id = 5
@@ -218,6 +628,13 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['updated'])
 
+    def test_editing_actor_with_fields(self):
+        res = self.client().patch('/actors/5?fields=age', headers=self.producer_token, json=self.edited_actor)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(data['updated']), ['age', 'id'])
+
     def test_404_patch_nonexistent_actor(self):
         actor_id = 10000
         res = self.client().patch(f'/actors/{actor_id}', headers=self.producer_token, json=self.edited_actor)
@@ -247,6 +664,89 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def test_editing_movies_in_bulk(self):
+        res = self.client().patch('/movies', headers=self.producer_token, json=[
+            {'id': 1, 'title': 'Renamed'},
+            {'id': 3, 'release_date': '2003-12-27'},
+            {'id': 1000, 'title': 'Missing'},
+            {'id': 4}
+        ])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([movie['id'] for movie in data['updated']], [1, 3])
+        self.assertEqual(data['updated'][0]['title'], 'Renamed')
+        self.assertEqual(data['updated'][1]['release_date'], 'Sat, 27 Dec 2003 00:00:00 GMT')
+        self.assertEqual(data['errors'], [
+            {'index': 3, 'message': 'nothing to update'},
+            {'id': 1000, 'message': 'resource not found'}
+        ])
+
+    def test_editing_movies_in_bulk_with_fields(self):
+        res = self.client().patch('/movies?fields=title', headers=self.producer_token,
+                                  json=[{'id': 1, 'title': 'Renamed'}])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], [{'id': 1, 'title': 'Renamed'}])
+
+    def test_403_editing_actors_in_bulk_as_assistant(self):
+        res = self.client().patch('/actors', headers=self.assistant_token, json=[{'id': 1, 'age': 40}])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+
+    def test_get_movie_actors(self):
+        res = self.client().get('/movies/10/actors', headers=self.assistant_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['actors']],
+                         ['Robert Downey Jr.', 'Scarlett Johansson', 'Chris Hemsworth'])
+        self.assertEqual(data['total_actors'], 3)
+
+    def test_404_get_nonexistent_movie_actors(self):
+        res = self.client().get('/movies/1000/actors', headers=self.assistant_token)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_movies_with_embedded_actors(self):
+        res = self.client().get('/movies?embed=actors&limit=100', headers=self.assistant_token)
+        data = json.loads(res.data)
+        casts = {movie['id']: [actor['id'] for actor in movie['actors']] for movie in data['movies']}
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(casts[5], [2])
+        self.assertEqual(casts[1], [])
+
+    def test_editing_movie_actors(self):
+        res = self.client().put('/movies/1/actors', headers=self.producer_token, json={'actors': [1, 3]})
+        movies = json.loads(self.client().get('/actors/3/movies', headers=self.assistant_token).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['id'] for movie in movies['movies']], [1, 10, 16])
+
+    def test_422_editing_movie_actors_with_nonexistent_actor(self):
+        res = self.client().put('/movies/1/actors', headers=self.producer_token, json={'actors': [1, 1000]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_seed_command(self):
+        result = self.app.test_cli_runner().invoke(
+            args=['seed', '--actors', '50', '--movies', '20', '--reset'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('rows/s', result.output)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 50)
+            self.assertEqual(Movie.query.count(), 20)
+
 
 
     """Tests of RBAC for each role"""
@@ -293,6 +793,386 @@ class CapstoneTestCase(unittest.TestCase):
 
 
 
+class AsgiTestCase(unittest.TestCase):
+    """The async app must answer like the sync one."""
+    def setUp(self):
+        self.database_path = "postgresql://{}/{}".format('localhost:5432', 'capstone_test')
+        self.app = create_app(self.database_path)
+        with self.app.app_context():
+            db_drop_and_create_all()
+
+        self.client = TestClient(create_asgi_app(self.database_path))
+        producer_envtoken = os.environ.get('PRODUCER_TOKEN')
+        self.producer_token = {'Authorization': f'Bearer {producer_envtoken}'}
+
+    def tearDown(self):
+        self.client.close()
+        with self.app.app_context():
+            db.drop_all()
+            db.session.commit()
+
+    def test_get_paginated_actors(self):
+        res = self.client.get('/actors?after=3&limit=5', headers=self.producer_token)
+        data = res.json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['actors'][0]['id'], 4)
+        self.assertEqual(data['next_cursor'], 8)
+        self.assertEqual(data['total_actors'], 16)
+
+    def test_adding_and_editing_movie(self):
+        res = self.client.post('/movies', headers=self.producer_token, json={'title': 'Titanic', 'release_date': '1997-12-19'})
+        movie_id = res.json()['added']
+
+        res = self.client.patch(f'/movies/{movie_id}', headers=self.producer_token, json={'release_date': '2003-12-27'})
+        data = res.json()
+
+        self.assertEqual(res.status_code, 200)
+        # Dates are rendered like Flask does
+        self.assertEqual(data['updated']['release_date'], 'Sat, 27 Dec 2003 00:00:00 GMT')
+
+    def test_404_delete_nonexistent_actor(self):
+        res = self.client.delete('/actors/1000', headers=self.producer_token)
+        data = res.json()
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_401_without_token(self):
+        res = self.client.get('/movies')
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.json()['success'], False)
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        """Build a local stand-in for the Auth0 JWKS endpoint."""
+        rsa_key = self.rsa_key = RSA.generate(2048)
+
+        def encode(number):
+            return base64url_encode(
+                number.to_bytes((number.bit_length() + 7) // 8, 'big')).decode()
+
+        self.jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': 'first-key',
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': encode(rsa_key.n),
+            'e': encode(rsa_key.e)
+        }]}
+        self.fetches = 0
+
+        def fetch():
+            self.fetches += 1
+            return self.jwks
+
+        self.key_store = JWKSKeyStore(fetch, ttl=60, stale_ttl=600, min_refresh_interval=30)
+
+    def test_keys_are_fetched_once(self):
+        for _ in range(10):
+            self.assertIsNotNone(self.key_store.get_key('first-key'))
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_refetches_once(self):
+        self.key_store.get_key('first-key')
+        # Only one refetch within min_refresh_interval
+        self.assertIsNone(self.key_store.get_key('rotated-key'))
+        self.assertIsNone(self.key_store.get_key('rotated-key'))
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_is_found_after_rotation(self):
+        self.key_store.min_refresh_interval = 0
+        self.key_store.get_key('first-key')
+        rotated = dict(self.jwks['keys'][0], kid='rotated-key')
+        self.jwks = {'keys': [rotated]}
+
+        self.assertIsNotNone(self.key_store.get_key('rotated-key'))
+        self.assertEqual(self.fetches, 2)
+
+    def test_stale_keys_are_served_while_refreshing(self):
+        self.key_store.min_refresh_interval = 0
+        self.key_store.get_key('first-key')
+        self.key_store._fetched_at -= 120
+
+        # The stale key is returned right away and refreshed in the background
+        self.assertIsNotNone(self.key_store.get_key('first-key'))
+        for _ in range(50):
+            if self.fetches == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.fetches, 2)
+
+    def test_algorithms_are_compared_by_name(self):
+        algorithms = parse_algorithms('RS256, RS384')
+
+        self.assertEqual(algorithms, ('RS256', 'RS384'))
+        for alg in ('RS', 'S256', 'RS2'):
+            self.assertNotIn(alg, algorithms)
+        self.assertIsNone(parse_algorithms(''))
+
+    def test_token_is_accepted_with_the_algorithms_of_setup_sh(self):
+        token = jwt.encode(
+            {'iss': 'https://test.auth0.com/', 'aud': 'capstone', 'exp': int(time.time()) + 60},
+            self.rsa_key.export_key().decode(), algorithm='RS256', headers={'kid': 'first-key'})
+        settings = {'ALGORITHMS': parse_algorithms("['RS256']"),
+                    'AUTH0_DOMAIN': 'test.auth0.com', 'API_AUDIENCE': 'capstone'}
+        previous = {name: getattr(auth, name) for name in settings}
+
+        try:
+            for name, value in settings.items():
+                setattr(auth, name, value)
+            payload = auth.decode_jwt(
+                token, jwt.get_unverified_header(token), self.key_store.get_key('first-key'))
+        finally:
+            for name, value in previous.items():
+                setattr(auth, name, value)
+
+        self.assertEqual(settings['ALGORITHMS'], ('RS256',))
+        self.assertEqual(payload['aud'], 'capstone')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.token_cache = TokenCache(max_size=2)
+        self.payload = {
+            'exp': time.time() + 3600,
+            'permissions': ['get:actors', 'get:movies']
+        }
+
+    def test_cached_token_is_a_hit(self):
+        self.assertIsNone(self.token_cache.get('token'))
+        self.token_cache.put('token', self.payload)
+        cached = self.token_cache.get('token')
+
+        self.assertEqual(cached.payload, self.payload)
+        self.assertIn('get:actors', cached.permissions)
+        self.assertEqual(self.token_cache.stats()['hits'], 1)
+        self.assertEqual(self.token_cache.stats()['misses'], 1)
+
+    def test_expired_token_is_a_miss(self):
+        self.token_cache.put('token', dict(self.payload, exp=time.time() - 1))
+        self.assertIsNone(self.token_cache.get('token'))
+
+    def test_least_recently_used_token_is_evicted(self):
+        for token in ['first', 'second', 'third']:
+            self.token_cache.put(token, self.payload)
+
+        self.assertIsNone(self.token_cache.get('first'))
+        self.assertIsNotNone(self.token_cache.get('third'))
+        self.assertEqual(self.token_cache.stats()['size'], 2)
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM actors WHERE id IN (%(id_1)s, %(id_2)s) AND name = 'Tom'"),
+            fingerprint("SELECT * FROM actors\nWHERE id IN (%(id_1)s) AND name = 'Ann'"))
+
+    def test_repeated_statements_are_reported(self):
+        stats = RequestStats()
+        for actor_id in range(5):
+            stats.record(f'SELECT * FROM actors WHERE id = {actor_id}', 0.001)
+        stats.record('SELECT count(*) FROM actors', 0.001)
+
+        self.assertEqual(stats.queries, 6)
+        self.assertEqual(stats.repeated(threshold=5),
+                         [('SELECT * FROM actors WHERE id = ?', 5)])
+        self.assertEqual(stats.repeated(threshold=0), [])
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.payload = {
+            'success': True,
+            'movies': [{'id': 1, 'title': 'Titanic', 'release_date': date(1997, 12, 19)}],
+            'next_cursor': None
+        }
+
+    def test_same_output_as_jsonify(self):
+        expected = DefaultJSONProvider(self.app).response(self.payload).get_data()
+        providers = [StdlibJSONProvider] + ([OrjsonProvider] if orjson else [])
+
+        for provider in providers:
+            self.assertEqual(provider(self.app).response(self.payload).get_data(), expected)
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_import_creates_no_app(self):
+        # app.app is only created when something looks it up
+        self.assertNotIn('app', vars(sys.modules['app']))
+
+    def test_create_app_does_not_connect(self):
+        # The database can't be opened, which only matters to the first query
+        app = create_app('sqlite:////nonexistent/capstone.db')
+
+        with app.app_context():
+            pool = db.engine.pool
+            self.assertEqual(pool.checkedin() + pool.checkedout(), 0)
+
+
+class SeedTestCase(unittest.TestCase):
+    def test_same_seed_gives_same_rows(self):
+        first = list(fake_actors(100, random.Random(7))) + list(fake_movies(100, random.Random(7)))
+        second = list(fake_actors(100, random.Random(7))) + list(fake_movies(100, random.Random(7)))
+
+        self.assertEqual(first, second)
+
+    def test_distributions(self):
+        actors = list(fake_actors(1000, random.Random(0), age_distribution='normal', female_ratio=1))
+
+        self.assertEqual({actor['gender'] for actor in actors}, {'Female'})
+        self.assertTrue(all(18 <= actor['age'] <= 90 for actor in actors))
+
+    def test_copy_statement_quotes_cast(self):
+        statement = copy_statement(postgresql.dialect(), cast, ['movie_id', 'actor_id'])
+
+        self.assertEqual(statement, 'COPY "cast" (movie_id, actor_id) FROM STDIN')
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        # SQLite files stand in for the primary and its replica
+        self.directory = tempfile.TemporaryDirectory()
+        primary = os.path.join(self.directory.name, 'primary.db')
+        replica = os.path.join(self.directory.name, 'replica.db')
+
+        with create_app(f'sqlite:///{primary}').app_context():
+            db_drop_and_create_all()
+        shutil.copy(primary, replica)
+        # The replica's copy of the first actor tells where a query went
+        with sqlite3.connect(replica) as connection:
+            connection.execute("UPDATE actors SET name = 'Replica' WHERE id = 1")
+
+        self.app = create_app(f'sqlite:///{primary}', replica_URIs=[f'sqlite:///{replica}'])
+
+    def tearDown(self):
+        replicas.clear()
+        with self.app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        self.directory.cleanup()
+
+    def first_actor_name(self):
+        return db.session.scalar(select(Actor.name).where(Actor.id == 1))
+
+    def test_get_requests_read_from_the_replica(self):
+        with self.app.test_request_context('/actors', method='GET'):
+            self.assertEqual(self.first_actor_name(), 'Replica')
+        with self.app.test_request_context('/actors', method='POST'):
+            self.assertEqual(self.first_actor_name(), 'Meryl Streep')
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        with self.app.test_request_context('/actors', method='GET'):
+            self.assertEqual(self.first_actor_name(), 'Replica')
+            db.session.execute(update(Actor).where(Actor.id == 2).values(age=66))
+
+            self.assertEqual(self.first_actor_name(), 'Meryl Streep')
+            db.session.rollback()
+
+    def test_read_only_text_stays_on_the_replica(self):
+        with self.app.test_request_context('/actors', method='GET'):
+            db.session.execute(text('SELECT 1').execution_options(read_only=True))
+            self.assertEqual(self.first_actor_name(), 'Replica')
+
+    def test_cache_misses_read_from_the_primary(self):
+        get_name = response_cache.cached('actors')(
+            lambda jwt: {'name': self.first_actor_name()})
+
+        with self.app.test_request_context('/replica-cache-test', method='GET'):
+            res = get_name({'permissions': []})
+        self.assertEqual(res.get_json()['name'], 'Meryl Streep')
+
+    def test_failed_replica_falls_back_to_the_primary(self):
+        app = create_app(self.app.config['SQLALCHEMY_DATABASE_URI'],
+                         replica_URIs=['sqlite:////nonexistent/replica.db'])
+
+        with app.test_request_context('/actors', method='GET'):
+            self.assertEqual(self.first_actor_name(), 'Meryl Streep')
+        self.assertFalse(replicas.status({'replica_0': None})['replica_0']['healthy'])
+
+
+class AdmissionTestCase(unittest.TestCase):
+    def test_full_queue_is_shed_right_away(self):
+        budget = Budget('test', limit=1, queue_size=0)
+
+        self.assertEqual(budget.acquire(), (True, 0.0, None))
+        self.assertEqual(budget.acquire(), (False, 0.0, 'queue_full'))
+        budget.release()
+        self.assertTrue(budget.acquire()[0])
+
+    def test_wait_is_bounded(self):
+        budget = Budget('test', limit=1, queue_size=1, timeout=0.05)
+        budget.acquire()
+
+        admitted, waited, reason = budget.acquire()
+        self.assertFalse(admitted)
+        self.assertGreaterEqual(waited, 0.05)
+        self.assertEqual(reason, 'timeout')
+
+    def test_requests_over_the_limit_get_503(self):
+        app = Flask(__name__)
+        admission = AdmissionControl(route_limits='GET /slow=1:0')
+        init_admission(app, admission)
+        app.add_url_rule('/slow', 'slow', lambda: 'done')
+        app.add_url_rule('/health', 'health', lambda: 'up')
+
+        # Another request holds the only slot of the route
+        admission.budget_for('GET', '/slow').acquire()
+        res = app.test_client().get('/slow')
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(app.test_client().get('/health').status_code, 200)
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        init_compression(self.app)
+        self.app.add_url_rule('/small', 'small', lambda: {'name': 'Tom Hanks'})
+        self.app.add_url_rule('/large', 'large', lambda: {'names': ['Tom Hanks'] * 500})
+
+        def stream():
+            return self.app.response_class(
+                (f'{{"id": {i}}}\n' for i in range(1000)), mimetype='application/x-ndjson')
+        self.app.add_url_rule('/stream', 'stream', stream)
+
+    def test_choose_encoding(self):
+        accept = lambda value: Flask(__name__).test_request_context(
+            headers={'Accept-Encoding': value}).request.accept_encodings
+
+        self.assertEqual(choose_encoding(accept('gzip, deflate')), 'gzip')
+        self.assertIsNone(choose_encoding(accept('identity')))
+        self.assertIsNone(choose_encoding(accept('gzip;q=0')))
+
+    def test_only_large_bodies_are_compressed(self):
+        client = self.app.test_client()
+        headers = {'Accept-Encoding': 'gzip'}
+
+        res = client.get('/small', headers=headers)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(res.json['name'], 'Tom Hanks')
+
+        res = client.get('/large', headers=headers)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(res.data))['names']), 500)
+
+        res = client.get('/large')
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_streamed_response_is_compressed(self):
+        res = self.app.test_client().get('/stream', headers={'Accept-Encoding': 'gzip'})
+        lines = gzip.decompress(res.data).decode().splitlines()
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(json.loads(lines[-1]), {'id': 999})
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()